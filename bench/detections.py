@@ -0,0 +1,120 @@
+"""Detection box conversion microbenchmark.
+
+Builds the detections of one frame and their measurements
+(`to_xyah`) several times per frame, as the tracker used to do once per
+matching cascade level and again in the update. Compares the original
+plain Detection, which converts on every call, the slotted Detection
+with cached conversions and the columnar DetectionBatch.
+
+    python -m bench.detections --detections 30 --builds 4
+"""
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+
+from tracker_deepsort.detection import Detection, DetectionBatch
+
+
+class OriginalDetection(object):
+    """The Detection before slots and caching, for comparison."""
+
+    def __init__(self, tlwh, confidence, feature, ts):
+        self.tlwh = np.asarray(tlwh, dtype=np.float64)
+        self.confidence = float(confidence)
+        self.feature = np.asarray(feature, dtype=np.float32)
+        self.ts = int(ts)
+
+    def to_tlbr(self):
+        ret = self.tlwh.copy()
+        ret[2:] += ret[:2]
+        return ret
+
+    def to_xyah(self):
+        ret = self.tlwh.copy()
+        ret[:2] += ret[2:] / 2
+        ret[2] /= ret[3]
+        return ret
+
+
+def per_detection_frame(cls, tlwh, confidence, features, ts, builds):
+    detections = [cls(tlwh[i], confidence[i], features[i], ts)
+                  for i in range(len(tlwh))]
+    for _ in range(builds):
+        np.asarray([d.to_xyah() for d in detections])
+
+
+def batch_frame(tlwh, confidence, features, ts, builds):
+    detections = DetectionBatch(tlwh, confidence, features, ts)
+    for _ in range(builds):
+        detections.to_xyah()
+
+
+def best_time(fun, number, repeat):
+    """Best mean seconds per call of `fun` over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fun()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def peak_bytes(fun):
+    """Peak memory allocated while running `fun` once, in bytes."""
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fun()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def instance_size(detection):
+    size = sys.getsizeof(detection)
+    if hasattr(detection, '__dict__'):
+        size += sys.getsizeof(detection.__dict__)
+    return size
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--detections", type=int, default=30)
+    parser.add_argument("--builds", type=int, default=4,
+                        help="Measurement builds per frame")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    tlwh = rng.uniform(10, 100, (args.detections, 4))
+    confidence = rng.uniform(size=args.detections).astype(np.float32)
+    features = rng.normal(size=(args.detections, args.dim)).astype(
+        np.float32)
+    ts = 1607076000
+
+    variants = [
+        ("original Detection", lambda: per_detection_frame(
+            OriginalDetection, tlwh, confidence, features, ts, args.builds)),
+        ("slotted Detection", lambda: per_detection_frame(
+            Detection, tlwh, confidence, features, ts, args.builds)),
+        ("DetectionBatch", lambda: batch_frame(
+            tlwh, confidence, features, ts, args.builds)),
+    ]
+    print(f"detections {args.detections}  builds per frame {args.builds}")
+    for name, fun in variants:
+        seconds = best_time(fun, args.number, args.repeat)
+        print(f"{name:<20}{seconds * 1e6:>10.1f} us/frame"
+              f"{peak_bytes(fun) / 1024.:>10.1f} KB peak allocation")
+    for cls in (OriginalDetection, Detection):
+        size = instance_size(cls(tlwh[0], 1., features[0], ts))
+        print(f"{cls.__name__:<20}{size:>10} bytes per instance")
+
+
+if __name__ == "__main__":
+    main()
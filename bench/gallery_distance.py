@@ -0,0 +1,94 @@
+"""Appearance cost matrix benchmark.
+
+Times NearestNeighborDistanceMetric.distance, which concatenates the
+samples of all queried targets and computes the cost matrix with one
+matrix product and a segmented minimum, against the original loop of one
+small product per target. Both are run for the cosine and the euclidean
+metric on random features.
+
+    python -m bench.gallery_distance --targets 50 --budget 100 --queries 30
+    python -m bench.gallery_distance --fill 0.2
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from tracker_deepsort.nn_matching import (
+    NearestNeighborDistanceMetric, _nn_cosine_distance,
+    _nn_euclidean_distance)
+
+
+def build_metric(kind, n_targets, budget, fill, dim, storage, seed=0):
+    """A metric whose targets hold `fill * budget` samples each."""
+    rng = np.random.RandomState(seed)
+    metric = NearestNeighborDistanceMetric(kind, 0.2, budget, storage)
+    targets = np.arange(1, n_targets + 1)
+    for _ in range(max(int(round(fill * budget)), 1)):
+        features = rng.normal(size=(n_targets, dim)).astype(np.float32)
+        metric.partial_fit(features, targets, targets.tolist())
+    return metric, targets
+
+
+def per_target_distance(kind, samples, features, targets):
+    """The original cost matrix: one product per target."""
+    nn = _nn_cosine_distance if kind == "cosine" else _nn_euclidean_distance
+    cost_matrix = np.zeros((len(targets), len(features)))
+    for i, target in enumerate(targets):
+        cost_matrix[i, :] = nn(samples[target], features)
+    return cost_matrix
+
+
+def best_time(fun, number, repeat):
+    """Best mean seconds per call of `fun` over `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fun()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=100)
+    parser.add_argument("--fill", type=float, default=1.,
+                        help="Fraction of the budget every target holds")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--storage", default="float32",
+                        choices=("float32", "float16", "int8"))
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(1)
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    print(f"targets {args.targets}  budget {args.budget}  fill {args.fill}  "
+          f"queries {args.queries}  dim {args.dim}  storage {args.storage}")
+    for kind in ("cosine", "euclidean"):
+        metric, targets = build_metric(
+            kind, args.targets, args.budget, args.fill, args.dim,
+            args.storage)
+        # The original code kept the samples in a dict of float arrays and
+        # normalized samples and queries on every call.
+        samples = metric.samples
+        per_target = best_time(
+            lambda: per_target_distance(kind, samples, queries, targets),
+            args.number, args.repeat)
+        segmented = best_time(
+            lambda: metric.distance(queries, targets), args.number,
+            args.repeat)
+        difference = np.abs(
+            per_target_distance(kind, samples, queries, targets) -
+            metric.distance(queries, targets)).max()
+        print(f"{kind:<10} per target {per_target * 1e3:8.3f} ms  "
+              f"segmented {segmented * 1e3:8.3f} ms  "
+              f"speedup {per_target / segmented:5.1f}x  "
+              f"max difference {difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
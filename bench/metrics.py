@@ -0,0 +1,128 @@
+import numpy as np
+import scipy.optimize
+
+from tracker_deepsort.iou_matching import iou_matrix
+
+
+class TrackingAccuracy(object):
+    """
+    Accumulates the CLEAR MOT (MOTA) and identity (IDF1) scores of a tracker
+    output against ground truth, frame by frame.
+    Parameters
+    ----------
+    iou_threshold : float
+        Minimum intersection over union of a hypothesis and a ground truth box
+        to count as a match.
+    """
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self.num_gt = 0
+        self.num_hypotheses = 0
+        self.misses = 0
+        self.false_positives = 0
+        self.id_switches = 0
+        self._matched = {}  # gt id -> hypothesis id of the previous match
+        self._current = {}  # gt id -> hypothesis id matched in last frame
+        self._pair_counts = {}  # (gt id, hypothesis id) -> matched frames
+        self._gt_frames = {}
+        self._hypothesis_frames = {}
+
+    def update(self, gt_ids, gt_tlwh, hypothesis_ids, hypothesis_tlwh):
+        """Add one frame.
+        Parameters
+        ----------
+        gt_ids : array_like
+            Identities of the ground truth objects.
+        gt_tlwh : ndarray
+            The Kx4 matrix of ground truth boxes.
+        hypothesis_ids : array_like
+            Track identities reported by the tracker.
+        hypothesis_tlwh : ndarray
+            The Lx4 matrix of reported track boxes.
+        """
+        gt_ids = np.asarray(gt_ids).tolist()
+        hypothesis_ids = np.asarray(hypothesis_ids).tolist()
+        self.num_gt += len(gt_ids)
+        self.num_hypotheses += len(hypothesis_ids)
+        for i in gt_ids:
+            self._gt_frames[i] = self._gt_frames.get(i, 0) + 1
+        for j in hypothesis_ids:
+            self._hypothesis_frames[j] = self._hypothesis_frames.get(j, 0) + 1
+
+        iou = np.zeros((len(gt_ids), len(hypothesis_ids)))
+        if len(gt_ids) > 0 and len(hypothesis_ids) > 0:
+            iou = iou_matrix(np.asarray(gt_tlwh, dtype=float),
+                             np.asarray(hypothesis_tlwh, dtype=float))
+        valid = iou >= self.iou_threshold
+
+        # Every pair above the threshold counts for the identity measures.
+        for r, c in zip(*np.nonzero(valid)):
+            pair = gt_ids[r], hypothesis_ids[c]
+            self._pair_counts[pair] = self._pair_counts.get(pair, 0) + 1
+
+        # CLEAR MOT: keep the correspondences of the previous frame that are
+        # still valid, match the remaining objects by maximum overlap.
+        gt_index = {i: r for r, i in enumerate(gt_ids)}
+        hypothesis_index = {j: c for c, j in enumerate(hypothesis_ids)}
+        matches = {}
+        for i, j in self._current.items():
+            r, c = gt_index.get(i), hypothesis_index.get(j)
+            if r is not None and c is not None and valid[r, c]:
+                matches[i] = j
+        free_rows = [r for r, i in enumerate(gt_ids) if i not in matches]
+        kept = set(matches.values())
+        free_cols = [c for c, j in enumerate(hypothesis_ids) if j not in kept]
+        if free_rows and free_cols:
+            cost = np.where(valid, 1. - iou, 2.)[np.ix_(free_rows, free_cols)]
+            rows, cols = scipy.optimize.linear_sum_assignment(cost)
+            for r, c in zip(rows, cols):
+                if cost[r, c] > 1.:
+                    continue
+                i, j = gt_ids[free_rows[r]], hypothesis_ids[free_cols[c]]
+                if i in self._matched and self._matched[i] != j:
+                    self.id_switches += 1
+                matches[i] = j
+
+        self.misses += len(gt_ids) - len(matches)
+        self.false_positives += len(hypothesis_ids) - len(matches)
+        self._matched.update(matches)
+        self._current = matches
+
+    def summary(self):
+        """Summarize all frames added so far.
+        Returns
+        -------
+        Dict[str -> float]
+            The `mota` and `idf1` scores and the error counts they are
+            computed from.
+        """
+        mota = 1. - float(
+            self.misses + self.false_positives + self.id_switches) / \
+            max(self.num_gt, 1)
+
+        # IDF1: one-to-one assignment of ground truth to hypothesis
+        # identities that maximizes the number of identity true positives.
+        gt_ids = sorted(self._gt_frames)
+        hypothesis_ids = sorted(self._hypothesis_frames)
+        idtp = 0
+        if gt_ids and hypothesis_ids:
+            gt_index = {i: r for r, i in enumerate(gt_ids)}
+            hypothesis_index = {j: c for c, j in enumerate(hypothesis_ids)}
+            counts = np.zeros((len(gt_ids), len(hypothesis_ids)))
+            for (i, j), count in self._pair_counts.items():
+                counts[gt_index[i], hypothesis_index[j]] = count
+            rows, cols = scipy.optimize.linear_sum_assignment(-counts)
+            idtp = int(counts[rows, cols].sum())
+        idf1 = 2. * idtp / max(self.num_gt + self.num_hypotheses, 1)
+
+        return {
+            "mota": mota,
+            "idf1": idf1,
+            "num_gt": self.num_gt,
+            "misses": self.misses,
+            "false_positives": self.false_positives,
+            "id_switches": self.id_switches,
+            "gt_ids": len(gt_ids),
+            "hypothesis_ids": len(hypothesis_ids),
+        }
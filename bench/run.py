@@ -0,0 +1,147 @@
+"""Offline tracker benchmark, no Kafka involved.
+
+Runs DeepSort over a deterministic synthetic scene or a recorded stream of
+gvametaconvert messages and reports throughput, per-stage latency
+percentiles, peak RSS and, where ground truth is available, MOTA/IDF1.
+
+    python -m bench.run synthetic --objects 200 --frames 500
+    python -m bench.run replay frames.jsonl --source cam1
+"""
+import json
+import resource
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from bench.metrics import TrackingAccuracy
+from bench.scenes import replay_scene, synthetic_scene
+from tracker_deepsort.deepsort import DeepSort
+
+
+def run(frames, **tracker_kwargs):
+    """Track `frames` and measure speed and accuracy.
+    Parameters
+    ----------
+    frames : Iterable[scenes.SceneFrame]
+        The scene to replay, preferably generated lazily so that it does not
+        count towards the peak RSS.
+    tracker_kwargs
+        Keyword arguments of `DeepSort`.
+    Returns
+    -------
+    Dict[str -> object]
+        The benchmark report.
+    """
+    # ru_maxrss is reported in kilobytes on Linux.
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    tracker = DeepSort(profile=True, **tracker_kwargs)
+    accuracy = TrackingAccuracy()
+    has_gt = True
+    out = np.empty((0, 5), np.int32)
+
+    elapsed = 0.
+    n_frames = 0
+    detections = 0
+    for frame in frames:
+        if len(frame.tlwh) > len(out):
+            out = np.empty((2 * len(frame.tlwh), 5), np.int32)
+        has_gt = has_gt and frame.gt_ids is not None
+        start = time.perf_counter()
+        tracks = tracker.process_arrays(
+            frame.tlwh, frame.confidence, frame.ts, frame.features, out=out)
+        elapsed += time.perf_counter() - start
+        n_frames += 1
+        detections += len(frame.tlwh)
+        if has_gt:
+            tracks = tracks[tracks[:, 4] >= 0]
+            accuracy.update(frame.gt_ids, frame.gt_tlwh,
+                            tracks[:, 4], tracks[:, :4])
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    report = {
+        "frames": n_frames,
+        "detections": detections,
+        "seconds": elapsed,
+        "fps": n_frames / elapsed if elapsed > 0 else float("inf"),
+        "peak_rss_mb": peak_rss,
+        # Growth of the peak over the interpreter and libraries loaded
+        # before the run.
+        "peak_rss_growth_mb": peak_rss - rss_before,
+        "stages": tracker.stats(),
+    }
+    if has_gt:
+        report["accuracy"] = accuracy.summary()
+    return report
+
+
+def print_report(report):
+    print(f"frames {report['frames']}  detections {report['detections']}  "
+          f"{report['fps']:.1f} fps  peak RSS {report['peak_rss_mb']:.0f} MB "
+          f"(+{report['peak_rss_growth_mb']:.0f} MB during the run)")
+    print(f"{'stage':<18}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    for name, stats in sorted(report["stages"].items(), key=_natural_key):
+        print(f"{name:<18}{stats['p50']:>10.3f}{stats['p95']:>10.3f}"
+              f"{stats['p99']:>10.3f}{stats['mean']:>10.3f}")
+    accuracy = report.get("accuracy")
+    if accuracy is not None:
+        print(f"MOTA {accuracy['mota']:.4f}  IDF1 {accuracy['idf1']:.4f}  "
+              f"misses {accuracy['misses']}  "
+              f"false positives {accuracy['false_positives']}  "
+              f"id switches {accuracy['id_switches']}")
+
+
+def _natural_key(item):
+    # Sorts cascade_level_10 after cascade_level_9.
+    name = item[0]
+    prefix = name.rstrip("0123456789")
+    return prefix, int(name[len(prefix):] or -1)
+
+
+def main():
+    common = ArgumentParser(add_help=False)
+    common.add_argument("--budget", type=int, default=None,
+                        help="Appearance gallery budget per track")
+    common.add_argument("--solver", default="components",
+                        help="Assignment solver: scipy, greedy or components")
+    common.add_argument("--storage", default="float32",
+                        help="Gallery storage: float32, float16 or int8")
+    common.add_argument("--nms-max-overlap", type=float, default=None,
+                        help="Run non-maximum suppression before tracking")
+    common.add_argument("--json", action="store_true",
+                        help="Print the report as JSON")
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    scenes = parser.add_subparsers(dest="scene")
+    scenes.required = True
+    synthetic = scenes.add_parser(
+        "synthetic", parents=[common], help="Synthetic crowded scene")
+    synthetic.add_argument("--objects", type=int, default=100)
+    synthetic.add_argument("--frames", type=int, default=300)
+    synthetic.add_argument("--miss-rate", type=float, default=0.1)
+    synthetic.add_argument("--false-positive-rate", type=float, default=0.02)
+    synthetic.add_argument("--seed", type=int, default=0)
+    replay = scenes.add_parser(
+        "replay", parents=[common], help="Recorded JSON lines dump")
+    replay.add_argument("path")
+    replay.add_argument("--source", default=None)
+    args = parser.parse_args()
+
+    if args.scene == "synthetic":
+        frames = synthetic_scene(
+            n_objects=args.objects, n_frames=args.frames,
+            miss_rate=args.miss_rate,
+            false_positive_rate=args.false_positive_rate, seed=args.seed)
+    else:
+        frames = replay_scene(args.path, source=args.source)
+
+    report = run(frames, nn_budget=args.budget,
+                 assignment_solver=args.solver, gallery_storage=args.storage,
+                 nms_max_overlap=args.nms_max_overlap)
+    if args.json:
+        print(json.dumps(report, indent=2, default=float))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
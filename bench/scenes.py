@@ -0,0 +1,135 @@
+import json
+
+import numpy as np
+
+from models.frame import decode_frame
+
+
+class SceneFrame(object):
+    """
+    One frame of a benchmark scene.
+    Parameters
+    ----------
+    ts : int
+        Frame Unix timestamp.
+    tlwh : ndarray
+        The Nx4 matrix of detected boxes.
+    confidence : ndarray
+        Detector confidence scores.
+    features : ndarray
+        The NxM float32 matrix of appearance features.
+    gt_ids : Optional[ndarray]
+        Ground truth identity of every ground truth box.
+    gt_tlwh : Optional[ndarray]
+        The Kx4 matrix of ground truth boxes, including objects that were
+        not detected in this frame.
+    """
+    __slots__ = ('ts', 'tlwh', 'confidence', 'features', 'gt_ids', 'gt_tlwh')
+
+    def __init__(self, ts, tlwh, confidence, features, gt_ids=None,
+                 gt_tlwh=None):
+        self.ts = ts
+        self.tlwh = tlwh
+        self.confidence = confidence
+        self.features = features
+        self.gt_ids = gt_ids
+        self.gt_tlwh = gt_tlwh
+
+
+def synthetic_scene(n_objects=100, n_frames=300, width=1920, height=1080,
+                    feature_dim=256, miss_rate=0.1, false_positive_rate=0.02,
+                    position_noise=2., feature_noise=0.3, seed=0):
+    """Generate a crowded scene of objects that move at constant velocity and
+    bounce off the image borders, with known ground truth.
+    Parameters
+    ----------
+    n_objects : int
+        Number of objects present in every frame.
+    n_frames : int
+        Number of frames.
+    width, height : int
+        Image size in pixels.
+    feature_dim : int
+        Dimensionality of the appearance features.
+    miss_rate : float
+        Probability that an object is not detected in a frame.
+    false_positive_rate : float
+        Expected number of false detections per object and frame.
+    position_noise : float
+        Standard deviation of the detected box position in pixels.
+    feature_noise : float
+        Standard deviation of the per-detection feature noise; identity
+        features have unit variance per dimension.
+    seed : int
+        Seed of the random number generator, the scene is deterministic.
+    Yields
+    ------
+    SceneFrame
+        The frames of the scene, generated one at a time so that the scene
+        does not count towards the memory of the tracker.
+    """
+    rng = np.random.RandomState(seed)
+    size = rng.uniform(40, 90, n_objects)
+    box_size = np.c_[size, 1.2 * size]
+    upper = np.array([width, height]) - box_size
+    position = rng.uniform(0, 1, (n_objects, 2)) * upper
+    velocity = rng.normal(0, 3, (n_objects, 2))
+    identity = rng.normal(size=(n_objects, feature_dim)).astype(np.float32)
+    ids = np.arange(1, n_objects + 1)
+
+    for f in range(n_frames):
+        position += velocity
+        bounce = (position < 0) | (position > upper)
+        velocity[bounce] *= -1
+        position = np.clip(position, 0, upper)
+        gt_tlwh = np.c_[position, box_size]
+
+        detected = rng.rand(n_objects) >= miss_rate
+        tlwh = gt_tlwh[detected].copy()
+        tlwh[:, :2] += rng.normal(0, position_noise, (len(tlwh), 2))
+        features = identity[detected] + rng.normal(
+            0, feature_noise, (len(tlwh), feature_dim)).astype(np.float32)
+
+        n_false = rng.poisson(false_positive_rate * n_objects)
+        if n_false > 0:
+            false_size = rng.uniform(40, 90, n_false)
+            false_tlwh = np.c_[
+                rng.uniform(0, 1, (n_false, 2)) * (width, height),
+                false_size, 1.2 * false_size]
+            tlwh = np.r_[tlwh, false_tlwh]
+            features = np.r_[features, rng.normal(
+                size=(n_false, feature_dim)).astype(np.float32)]
+
+        order = rng.permutation(len(tlwh))
+        yield SceneFrame(
+            ts=1000 + f, tlwh=tlwh[order],
+            confidence=rng.uniform(0.6, 1., len(tlwh)),
+            features=features[order], gt_ids=ids, gt_tlwh=gt_tlwh)
+
+
+def replay_scene(path, source=None, feature_dim=256):
+    """Load a recorded stream of gvametaconvert messages, one JSON message
+    per line. Messages with a `source` other than `source` are skipped.
+    ROIs may carry an optional `gt_id` field, which is then used as ground
+    truth for the detected boxes.
+    Yields
+    ------
+    SceneFrame
+        The frames in recording order, read one line at a time.
+    """
+    with open(path, 'rb') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            message = json.loads(line)
+            if source is not None and message['source'] != source:
+                continue
+            batch = decode_frame(message, feature_dim=feature_dim)
+            gt_ids = [roi.get('gt_id') for roi in message.get('objects') or ()
+                      if any(t['name'] == 'face_id' for t in roi['tensors'])]
+            has_gt = None not in gt_ids
+            yield SceneFrame(
+                ts=batch.ts, tlwh=batch.boxes, confidence=batch.confidences,
+                features=batch.features,
+                gt_ids=np.asarray(gt_ids, dtype=np.int64) if has_gt else None,
+                gt_tlwh=batch.boxes if has_gt else None)
@@ -0,0 +1,136 @@
+"""Visit pipeline time handling microbenchmark, no Kafka involved.
+
+Measures the per-event time handling of the KKM agents on synthetic
+visits, track updates and receipts of one register: once the way the
+agents used to do it, with pytz localized datetimes, DateTimeRange objects
+and a linear scan over the visits for every receipt, and once on integer
+epoch seconds with visits.interval_index.IntervalIndex. The old variant
+needs the `datetimerange` package and is skipped without it.
+
+    python -m bench.visit_time --visits 2000 --receipts 500
+"""
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+from pytz import timezone
+
+from visits.interval_index import IntervalIndex
+
+localtz = timezone('Europe/Moscow')
+
+
+def synthetic_visits(n_visits, n_receipts, seed=0):
+    """Visits of 30-600 s and receipts of 120 s on one register, as
+    `(track_id, start, end)` and `(guid, start, end)` epoch seconds.
+    """
+    rng = random.Random(seed)
+    start = 1600000000
+    span = n_visits * 30
+    visits = []
+    for i in range(n_visits):
+        begin = start + rng.randrange(span)
+        visits.append((str(i), begin, begin + rng.randint(30, 600)))
+    receipts = []
+    for i in range(n_receipts):
+        begin = start + rng.randrange(span)
+        receipts.append((str(i), begin, begin + 120))
+    return visits, receipts
+
+
+def per_event(fun, items):
+    """Mean seconds per item of `fun(item)`."""
+    start = time.perf_counter()
+    for item in items:
+        fun(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def run_datetimes(visits, receipts):
+    from datetimerange import DateTimeRange
+
+    ranges = {}
+
+    def visit_event(visit):
+        track_id, start, end = visit
+        start_ts = localtz.localize(datetime.fromtimestamp(start))
+        last_ts = localtz.localize(datetime.fromtimestamp(end))
+        ranges[track_id] = (start_ts, DateTimeRange(start_ts, last_ts))
+
+    def track_event(visit):
+        track_id, _, end = visit
+        start_ts = ranges[track_id][0]
+        last_ts = localtz.localize(datetime.fromtimestamp(end + 1))
+        ranges[track_id] = (start_ts, DateTimeRange(start_ts, last_ts))
+
+    def receipt_event(receipt):
+        _, start, end = receipt
+        time_range = DateTimeRange(
+            datetime.fromtimestamp(start, localtz),
+            datetime.fromtimestamp(end, localtz))
+        return max(
+            [r for _, r in ranges.values() if time_range.is_intersection(r)],
+            key=lambda r: time_range.intersection(r).get_timedelta_second(),
+            default=None)
+
+    return {
+        "visit": per_event(visit_event, visits),
+        "track": per_event(track_event, visits),
+        "receipt": per_event(receipt_event, receipts),
+    }
+
+
+def run_epochs(visits, receipts):
+    index = IntervalIndex()
+
+    def visit_event(visit):
+        track_id, start, end = visit
+        index.add(track_id, int(start), int(end))
+
+    def track_event(visit):
+        track_id, _, end = visit
+        index.update_end(track_id, int(end + 1))
+
+    def receipt_event(receipt):
+        _, start, end = receipt
+        return index.best_overlap(start, end)
+
+    def encode_event(visit):
+        # The only conversion left, once per flushed Mongo document.
+        _, start, end = visit
+        return (datetime.fromtimestamp(start, localtz),
+                datetime.fromtimestamp(end, localtz))
+
+    return {
+        "visit": per_event(visit_event, visits),
+        "track": per_event(track_event, visits),
+        "receipt": per_event(receipt_event, receipts),
+        "encode": per_event(encode_event, visits),
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--visits", type=int, default=2000)
+    parser.add_argument("--receipts", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    visits, receipts = synthetic_visits(args.visits, args.receipts, args.seed)
+    print(f"visits {args.visits}  receipts {args.receipts}")
+    epochs = run_epochs(visits, receipts)
+    try:
+        datetimes = run_datetimes(visits, receipts)
+    except ImportError:
+        print("datetimerange is not installed, skipping the old variant")
+        datetimes = {}
+    print(f"{'event':<10}{'datetimes':>14}{'epoch seconds':>16}")
+    for name in ("visit", "track", "receipt", "encode"):
+        old = datetimes.get(name)
+        old = f"{old * 1e6:>11.1f} us" if old is not None else f"{'-':>14}"
+        print(f"{name:<10}{old}{epochs[name] * 1e6:>13.1f} us")
+
+
+if __name__ == "__main__":
+    main()
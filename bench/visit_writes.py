@@ -0,0 +1,147 @@
+"""Visit persistence benchmark, no Kafka involved.
+
+Replays a synthetic stream of visit and track updates into MongoDB, once
+with one awaited write per event as the agents used to do and once through
+visits.persistence.WriteBehindWriter, and reports events/s of both. Runs
+against a mongod given by --mongo-url, or against an in-process mongomock
+collection with an artificial round trip latency.
+
+    python -m bench.visit_writes --tracks 2000 --events 50000 --latency-ms 1
+    python -m bench.visit_writes --mongo-url mongodb://localhost:27017
+"""
+import asyncio
+import random
+import time
+from argparse import ArgumentParser
+
+from visits.persistence import WriteBehindWriter
+
+
+class MockCollection(object):
+    """Async facade of a mongomock collection that sleeps `latency` seconds
+    per call, standing in for the round trip to a mongod.
+    """
+
+    def __init__(self, collection, latency=0.):
+        self._collection = collection
+        self.latency = latency
+
+    async def _call(self, name, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return getattr(self._collection, name)(*args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._call('update_one', *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._call('bulk_write', *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return await self._call('create_index', *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self._call('delete_many', *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await self._call('count_documents', *args, **kwargs)
+
+
+def synthetic_events(n_tracks, n_events, seed=0):
+    """Visit documents of `n_tracks` tracks, each event extends a random
+    track's `last_ts`.
+    """
+    rng = random.Random(seed)
+    start = 1600000000
+    visits = [{
+        'track_id': f'ap29kassa1-{i}',
+        'computer': 'AP29Kassa1',
+        'ap': 'AP29',
+        'state': 1,
+        'face_id': str(i),
+        'start_ts': start + i,
+        'last_ts': start + i,
+        'kkm_guid': None,
+    } for i in range(n_tracks)]
+    events = []
+    for _ in range(n_events):
+        visit = rng.choice(visits)
+        visit['last_ts'] += rng.randint(1, 5)
+        events.append((visit['track_id'], dict(visit)))
+    return events
+
+
+async def run_inline(collection, events):
+    start = time.perf_counter()
+    for track_id, fields in events:
+        await collection.update_one(
+            {'track_id': track_id}, {'$set': fields}, upsert=True)
+    return time.perf_counter() - start
+
+
+async def run_write_behind(collection, events, max_batch, max_pending,
+                           flush_interval):
+    writer = WriteBehindWriter(
+        collection, max_batch=max_batch, max_pending=max_pending)
+
+    async def flush_periodically():
+        while True:
+            await asyncio.sleep(flush_interval)
+            await writer.flush()
+
+    start = time.perf_counter()
+    timer = asyncio.ensure_future(flush_periodically())
+    for track_id, fields in events:
+        await writer.put(track_id, fields)
+        # Yield like an agent between Kafka messages.
+        await asyncio.sleep(0)
+    timer.cancel()
+    await writer.close()
+    return time.perf_counter() - start, writer
+
+
+async def main_async(args):
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        collection = AsyncIOMotorClient(args.mongo_url)['bench']['vis']
+    else:
+        import mongomock
+        collection = MockCollection(
+            mongomock.MongoClient()['bench']['vis'], args.latency_ms / 1000.)
+    await collection.create_index('track_id')
+    events = synthetic_events(args.tracks, args.events, seed=args.seed)
+
+    await collection.delete_many({})
+    inline = await run_inline(collection, events)
+    inline_docs = await collection.count_documents({})
+
+    await collection.delete_many({})
+    write_behind, writer = await run_write_behind(
+        collection, events, args.batch, args.max_pending, args.flush_interval)
+    docs = await collection.count_documents({})
+
+    print(f"events {len(events)}  tracks {args.tracks}")
+    print(f"inline        {len(events) / inline:>12.0f} events/s  "
+          f"{inline_docs} documents")
+    print(f"write-behind  {len(events) / write_behind:>12.0f} events/s  "
+          f"{docs} documents, {writer.written} upserts "
+          f"in {writer.flushes} bulk writes")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default=None,
+                        help="Benchmark a mongod instead of mongomock")
+    parser.add_argument("--latency-ms", type=float, default=1.,
+                        help="Round trip latency of the mongomock stand-in")
+    parser.add_argument("--tracks", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--max-pending", type=int, default=10000)
+    parser.add_argument("--flush-interval", type=float, default=1.)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
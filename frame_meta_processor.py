@@ -1,39 +1,214 @@
 import faust
 import asyncio
-from models.Frame import Frame
-from tracker_deepsort.detection import Detection
-from tracker_deepsort.deepsort import DeepSort
-from tracker_deepsort.tracker import Tracker
+import base64
+import os
+from models.frame import Frame, decode_frame
+from tracker_deepsort.detection import DetectionBatch
+from tracker_deepsort.pool import TrackerPool
+from tracker_deepsort.track import TrackState
 N = 1
+FEATURE_DIM = 256
+FRAME_TOPIC_NAME = os.getenv("FRAME_TOPIC", "AP29kassa1-archive-04-12")
+# Frames of one stream always land on the same partition, hence on the same
+# worker; run several workers to spread cameras across cores.
+FRAME_PARTITIONS = int(os.getenv("FRAME_PARTITIONS", 1))
+# Set if the producer already keys frames by stream, skips repartitioning.
+FRAME_KEYED_BY_STREAM = bool(int(os.getenv("FRAME_KEYED_BY_STREAM", 0)))
+TRACKER_MAX_IDLE = float(os.getenv("TRACKER_MAX_IDLE", 300))
+# Frames are consumed in batches of up to FRAME_BATCH_SIZE messages or
+# FRAME_BATCH_WITHIN seconds, whichever comes first. 1 disables batching.
+FRAME_BATCH_SIZE = int(os.getenv("FRAME_BATCH_SIZE", 64))
+FRAME_BATCH_WITHIN = float(os.getenv("FRAME_BATCH_WITHIN", 0.5))
+# Validate frames with the pydantic models instead of the fast decoder.
+FRAME_VALIDATE = bool(int(os.getenv("FRAME_VALIDATE", 0)))
+# Tracker state of a stream is checkpointed every SNAPSHOT_EVERY frames (0
+# disables it). A snapshot holds about tracks x NN_BUDGET x FEATURE_DIM
+# gallery values and has to fit into one Kafka message, so the gallery is
+# bounded by default while snapshots are on (NN_BUDGET=0 is unbounded), and
+# snapshots larger than SNAPSHOT_MAX_BYTES are skipped.
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", 300))
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", 900000))
+NN_BUDGET = int(os.getenv("NN_BUDGET", 10 if SNAPSHOT_EVERY else 0)) or None
+GALLERY_STORAGE = os.getenv("GALLERY_STORAGE", "float32")
+
 app = faust.App(
     f'frame-meta-test-{N}',
     broker='kafka://10.42.0.26:9092',
     value_serializer='json',
     store='memory://',
-    version=2, topic_partitions=1
+    version=2, topic_partitions=FRAME_PARTITIONS
 )
 
-FRAME_TOPIC = app.topic('AP29kassa1-archive-04-12')
+FRAME_TOPIC = app.topic(FRAME_TOPIC_NAME, partitions=FRAME_PARTITIONS)
 TRACKS_TOPIC = app.topic('visits_test')
+# Latest tracker snapshot per stream key: {'ts', 'offset', 'state'}.
+snapshots = app.Table(
+    'tracker-snapshots', default=None, partitions=FRAME_PARTITIONS,
+    use_partitioner=True)
+
+trackers = TrackerPool(
+    max_idle=TRACKER_MAX_IDLE, nn_budget=NN_BUDGET,
+    gallery_storage=GALLERY_STORAGE)
+frames_since_snapshot = {}
+# Timestamp and offset of the last frame tracked per stream key.
+last_frame = {}
+# Offset of the snapshot a stream was restored from, until the replayed
+# frames it already covers have been skipped.
+replay_offsets = {}
+
+
+def stream_key(value):
+    return f"{value['tags']['computer']}/{value['source']}"
+
+
+def get_tracker(key):
+    """Returns the tracker of stream `key`. A new tracker is restored from
+    the stream's latest snapshot, if there is one, and the frames up to the
+    snapshot's offset are skipped from then on.
+    """
+    if key in trackers:
+        return trackers.get(key)
+    ds_tracker = trackers.get(key)
+    frames_since_snapshot[key] = 0
+    snapshot = snapshots.get(key)
+    if snapshot is None:
+        return ds_tracker
+    ds_tracker.restore(base64.b64decode(snapshot['state']))
+    replay_offsets[key] = snapshot['offset']
+    print(f'Restored tracker {key} at ts {snapshot["ts"]}, '
+          f'offset {snapshot["offset"]}')
+    return ds_tracker
+
+
+def save_snapshot(key, ds_tracker, ts, offset):
+    state = base64.b64encode(ds_tracker.snapshot()).decode('ascii')
+    frames_since_snapshot[key] = 0
+    if len(state) > SNAPSHOT_MAX_BYTES:
+        print(f'Skipped snapshot of tracker {key}: {len(state)} bytes, '
+              f'limit {SNAPSHOT_MAX_BYTES}; lower NN_BUDGET or use a '
+              f'smaller GALLERY_STORAGE')
+        return
+    snapshots[key] = {'ts': ts, 'offset': offset, 'state': state}
+
+
+def evict_tracker(key):
+    """Drop the tracker of stream `key` after checkpointing it. Offsets of
+    the frames it has seen since its last snapshot may be committed
+    already, so without a fresh snapshot the stream would be restored to an
+    older state and hand out track ids that were sent before.
+    """
+    ds_tracker = trackers.evict(key)
+    if ds_tracker is not None and SNAPSHOT_EVERY and \
+            frames_since_snapshot.get(key) and key in last_frame:
+        save_snapshot(key, ds_tracker, *last_frame[key])
+    frames_since_snapshot.pop(key, None)
+    last_frame.pop(key, None)
+    replay_offsets.pop(key, None)
+
+
+def track_stream_frames(key, values, offsets):
+    """Run the tracker of stream `key` on its frame messages, in order, and
+    return the outgoing messages for the confirmed tracks they matched.
+    `offsets` are the Kafka offsets of the messages.
+    """
+    ds_tracker = get_tracker(key)
+    table = ds_tracker.tracker.table
+    replayed = replay_offsets.get(key)
+    if replayed is not None:
+        # Frames replayed after a restart are part of the snapshot up to its
+        # offset. The replay may span several batches.
+        kept = [i for i, offset in enumerate(offsets) if offset > replayed]
+        if kept:
+            del replay_offsets[key]
+        values = [values[i] for i in kept]
+        offsets = [offsets[i] for i in kept]
+    if FRAME_VALIDATE:
+        frames = [Frame(**value).to_batch(feature_dim=FEATURE_DIM)
+                  for value in values]
+    else:
+        frames = [decode_frame(value, feature_dim=FEATURE_DIM)
+                  for value in values]
+    messages = []
+    for frame in frames:
+        detections = DetectionBatch(
+            frame.boxes, frame.confidences, frame.features, frame.ts)
+        matches, _, _ = ds_tracker.update(detections)
+        messages += [{'computer': frame.computer,
+                      'source': frame.source,
+                      'track_id': int(table.track_id[slot]),
+                      'last_ts': int(table.last_ts[slot]),
+                      'state': int(table.state[slot])}
+                     for slot, _ in matches
+                     if table.state[slot] == TrackState.Confirmed]
+    if frames:
+        last_frame[key] = (frames[-1].ts, offsets[-1])
+    frames_since_snapshot[key] += len(frames)
+    if SNAPSHOT_EVERY and frames and \
+            frames_since_snapshot[key] >= SNAPSHOT_EVERY:
+        save_snapshot(key, ds_tracker, frames[-1].ts, offsets[-1])
+    return messages
+
+
+async def process_frame_batch(values, offsets):
+    # Frames of one stream must be tracked in order, frames of different
+    # streams are independent. All frames of a stream come from the same
+    # partition, so their offsets mark the stream's progress.
+    by_stream = {}
+    for value, offset in zip(values, offsets):
+        stream_values, stream_offsets = by_stream.setdefault(
+            stream_key(value), ([], []))
+        stream_values.append(value)
+        stream_offsets.append(offset)
+    await asyncio.gather(*[
+        TRACKS_TOPIC.send(key=key, value=message)
+        for key, (stream_values, stream_offsets) in by_stream.items()
+        for message in track_stream_frames(
+            key, stream_values, stream_offsets)])
+
+
+# Offset commits started after frame batches, kept until they are done.
+commit_tasks = set()
+
+
+def commit_done(task):
+    commit_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f'Frame offset commit failed: {task.exception()!r}')
 
 
 @app.agent(FRAME_TOPIC)
 async def process_stream_frames(stream):
-    ds_tracker = DeepSort()
+    if not FRAME_KEYED_BY_STREAM:
+        stream = stream.group_by(stream_key, name='stream')
+    if FRAME_BATCH_SIZE > 1:
+        # take() keeps consuming in the background, so current_event may
+        # already be past the batch; record the offset of every value as it
+        # enters the batch instead.
+        offsets = []
+
+        def record_offset(value):
+            offsets.append(stream.current_event.message.offset)
+            return value
+
+        stream.add_processor(record_offset)
+        async for values in stream.take(
+                FRAME_BATCH_SIZE, within=FRAME_BATCH_WITHIN):
+            batch_offsets = offsets[:len(values)]
+            del offsets[:len(values)]
+            await process_frame_batch(values, batch_offsets)
+            # take() acks the events of a batch only after this body returns,
+            # when the next batch is requested and before it waits for new
+            # events; frames already buffered for the next batch stay
+            # unacked. A commit awaited here would only cover the previous
+            # batch. The task first runs at that wait, after the acks, so it
+            # commits the frames tracked so far and none that are buffered.
+            commit = asyncio.ensure_future(app.consumer.commit())
+            commit_tasks.add(commit)
+            commit.add_done_callback(commit_done)
+        return
     async for event in stream.events():
         async with event:
-            detection_list = []
-            frame = Frame(**event.value)
-            for roi in frame.objects:
-                det = Detection(
-                    tlwh=[roi.x, roi.y, roi.w, roi.h],
-                    confidence=roi.detection.confidence,
-                    feature=await roi.get_face_feature(),
-                    ts=frame.ts)
-
-                detection_list.append(det)
-            c, d = ds_tracker.update(detection_list)
-            await TRACKS_TOPIC.send()
+            await process_frame_batch([event.value], [event.message.offset])
 
             # print(frame.dict())
             # if frame.objects is not None:
@@ -46,7 +221,29 @@ async def process_stream_frames(stream):
 @app.timer(interval=1.0)
 async def every_1s():
     print(
-        f'Events/s :{app.monitor.events_s} | avg event runtime {app.monitor.events_runtime_avg*1000:.2f}ms ')
+        f'Events/s :{app.monitor.events_s} | avg event runtime {app.monitor.events_runtime_avg*1000:.2f}ms | trackers {len(trackers)}')
+
+
+# The snapshots table uses the key partitioner, so it can be written from
+# timers and rebalance callbacks, outside of stream iteration.
+@app.timer(interval=60.0)
+async def evict_idle_trackers():
+    for key in trackers.idle():
+        evict_tracker(key)
+        print(f'Evicted idle tracker {key}')
+
+
+@app.on_partitions_revoked.connect
+async def drop_trackers(app, revoked, **kwargs):
+    # Streams may move to another worker, which restores them from their
+    # snapshots; trackers of streams that stay here are restored likewise.
+    # Without snapshots there is nothing to restore from, keep them.
+    if not SNAPSHOT_EVERY:
+        return
+    for key in list(trackers.trackers):
+        evict_tracker(key)
+    # The new owner recovers the table right after the rebalance.
+    await app.producer.flush()
 
 if __name__ == "__main__":
     app.run()
@@ -2,12 +2,16 @@ import faust
 import os
 from datetime import datetime, timedelta
 from typing import Optional, List
-from datetimerange import DateTimeRange
 import asyncio
+from collections import defaultdict
 from pytz import timezone
 import binascii
 from motor.motor_asyncio import AsyncIOMotorClient
 from databases import DatabaseURL
+from visits.interval_index import IntervalIndex
+from visits.pending import PendingReceipts
+from visits.persistence import WriteBehindWriter
+from visits.store import VisitStore
 
 MONGO_HOST = os.getenv("MONGO_HOST", "10.42.0.26")
 MONGO_PORT = int(os.getenv("MONGO_PORT", 27017))
@@ -24,14 +28,44 @@ KKM_TOPIC = 'KKM'
 VISIT_TOPIC = 'face_visits_01'
 TRACKS_TOPIC = 'test_tracks_00'
 KAFKA_BROKER = 'kafka://10.42.0.26:9092'
+# Visits that are still open and unmatched are forgotten VISIT_TTL seconds
+# after their track was last seen, closed or matched ones after
+# VISIT_CLOSED_TTL seconds.
+VISIT_TTL = int(os.getenv("VISIT_TTL", 3600))
+VISIT_CLOSED_TTL = int(os.getenv("VISIT_CLOSED_TTL", 600))
+# Visit documents are written behind the agents: updates are coalesced per
+# track and upserted in bulk every VISIT_FLUSH_INTERVAL seconds or once
+# VISIT_FLUSH_BATCH tracks are pending. Agents block at VISIT_MAX_PENDING.
+VISIT_FLUSH_INTERVAL = float(os.getenv("VISIT_FLUSH_INTERVAL", 1.0))
+VISIT_FLUSH_BATCH = int(os.getenv("VISIT_FLUSH_BATCH", 500))
+VISIT_MAX_PENDING = int(os.getenv("VISIT_MAX_PENDING", 10000))
+# Receipts, visits and tracks are repartitioned by register into
+# KKM_PARTITIONS partitions, so registers spread across workers. Set KKM_STORE
+# to rocksdb:// to keep the tables on disk and recover them locally after a
+# restart instead of replaying the whole changelog.
+KKM_PARTITIONS = int(os.getenv("KKM_PARTITIONS", 1))
+KKM_STORE = os.getenv("KKM_STORE", "memory://")
+# A receipt without an overlapping visit waits until the event time of its
+# register is RECEIPT_LATENESS seconds past its end, for a late visit or a
+# track update that extends one. At most RECEIPT_MAX_PENDING receipts wait
+# per register.
+RECEIPT_LATENESS = int(os.getenv("RECEIPT_LATENESS", 300))
+RECEIPT_MAX_PENDING = int(os.getenv("RECEIPT_MAX_PENDING", 1000))
 
 
 class KKMVISITS(faust.App):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.table_kkm = {}
-        self.table_visits = {}
-        self.persist_table_visits = {}
+        # VisitStore over the visits table, see below.
+        self.table_visits = None
+        # Per register: unassigned visits by integer epoch time range.
+        self.visit_index = defaultdict(IntervalIndex)
+        # Per register: receipts waiting for a visit.
+        self.pending_receipts = defaultdict(lambda: PendingReceipts(
+            lateness=RECEIPT_LATENESS, max_pending=RECEIPT_MAX_PENDING))
+        # Registers whose waiting receipts have to be checked against all
+        # visits, after recovery.
+        self.pending_rescan = set()
 
 
 app = KKMVISITS('faust-kkm-to-track-stage', version=2)
@@ -41,13 +75,52 @@ def ts_to_iso(utime: int):
     return datetime.fromtimestamp(utime).isoformat()
 
 
+def to_epoch(value):
+    """Epoch seconds of a Unix timestamp, a datetime or an ISO 8601 string.
+    Naive datetimes are in local time. Visit matching works on epoch
+    seconds only.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = localtz.localize(value)
+    return int(value.timestamp())
+
+
+def visit_document(fields):
+    """Mongo document of a visit: epoch seconds become local time aware
+    datetimes. Only called when a batch of visits is written.
+    """
+    document = dict(fields)
+    for name in ('start_ts', 'last_ts'):
+        if document.get(name) is not None:
+            document[name] = datetime.fromtimestamp(document[name], localtz)
+    return document
+
+
+def visit_key(computer, track_id):
+    """Table key of a visit. Trackers number their tracks per camera, so
+    the same track id turns up at several registers.
+    """
+    return f'{computer.lower()}/{track_id}'
+
+
+# Documents are keyed by register and track id like the visits table.
+visit_writer = WriteBehindWriter(
+    db['vis']['vis'], key_field=('computer', 'track_id'),
+    max_batch=VISIT_FLUSH_BATCH, max_pending=VISIT_MAX_PENDING,
+    encode=visit_document)
+
+
 @app.on_configured.connect
 def configure_from_settings(app, conf, **kwargs):
     conf.broker = KAFKA_BROKER
     conf.value_serializer = 'json'
-    conf.store = 'memory://'
+    conf.store = KKM_STORE
     conf.version = 2
-    conf.topic_partitions = 1
+    conf.topic_partitions = KKM_PARTITIONS
     #    conf.autodiscover = True
 
 
@@ -57,8 +130,8 @@ class Visit(faust.Record, serializer='json'):
     ap: str
     state: int
     face_id: str
-    start_ts: Optional[datetime]
-    last_ts: Optional[datetime]
+    start_ts: int
+    last_ts: int
     kkm_guid: str = None
 
 
@@ -75,79 +148,222 @@ class KKMInKafka(faust.Record, serializer='json'):
     customer_id: str
     customer_phone: str
     start_ts_iso: Optional[datetime]
-    time_range: DateTimeRange = None
 
 
-persist_table_tracks = app.Table('Tracks0',value_type=Visit)
+# Visits by visit_key, the visit key of every matched receipt guid and the
+# receipts waiting for a visit. Tables are only written while processing an
+# event of the visit's register, so their changelogs are partitioned by
+# register like the streams.
+visits_table = app.Table(
+    'kkm-visits', value_type=Visit, partitions=KKM_PARTITIONS)
+receipts_table = app.Table('kkm-receipts', partitions=KKM_PARTITIONS)
+pending_table = app.Table('kkm-pending-receipts', partitions=KKM_PARTITIONS)
+app.table_visits = VisitStore(
+    closed_ttl=VISIT_CLOSED_TTL, open_ttl=VISIT_TTL, visits=visits_table,
+    key=lambda visit: visit_key(visit.computer, visit.track_id))
 
 
 VISIT_TOPIC = app.topic(VISIT_TOPIC, value_type=Visit)
 TRACKS_TOPIC = app.topic(
     TRACKS_TOPIC, key_serializer='raw', value_type=TrackLastTS)
 KKM_TOPIC = app.topic(KKM_TOPIC, value_type=KKMInKafka)
+# Track updates keyed by register. The register is only known from the
+# message key of TRACKS_TOPIC, which group_by does not see.
+TRACKS_BY_REGISTER = app.topic(
+    'kkm-tracks-by-register', key_serializer='raw', value_type=TrackLastTS,
+    partitions=KKM_PARTITIONS)
+
+
+async def assign_receipt(computer, guid, track_id):
+    app.visit_index[computer].remove(track_id)
+    key = visit_key(computer, track_id)
+    visit = app.table_visits.get(key)
+    visit.kkm_guid = guid
+    app.table_visits.touch(visit)
+    receipts_table[guid] = key
+    await visit_writer.put((visit.computer, visit.track_id), visit.asdict())
+
+
+async def match_pending(computer, receipts):
+    """Match waiting receipts of register `computer` to their best visit.
+    Called with the receipts that overlap the part of a visit's range that
+    was just added, so settled receipts are never scanned again.
+    """
+    pending = app.pending_receipts[computer]
+    index = app.visit_index[computer]
+    for guid, start, end in receipts:
+        match = index.best_overlap(start, end)
+        if match is not None:
+            pending.remove(guid)
+            pending_table.pop(guid, None)
+            await assign_receipt(computer, guid, match[0])
+
+
+async def advance_register(computer, now):
+    """Forget the visits of register `computer` that are due at event time
+    `now` and give up the receipts that fell behind its watermark. Deletes
+    table keys, so it must run while an event of the register is being
+    processed.
+    """
+    pending = app.pending_receipts[computer]
+    if computer in app.pending_rescan:
+        app.pending_rescan.discard(computer)
+        await match_pending(computer, pending.receipts())
+    index = app.visit_index[computer]
+    for visit in app.table_visits.expire(now, computer):
+        index.remove(visit.track_id)
+        if visit.kkm_guid is not None:
+            receipts_table.pop(visit.kkm_guid, None)
+    for guid in pending.advance(now):
+        pending_table.pop(guid, None)
+
+
+@visits_table.on_recover
+async def rebuild_visit_state():
+    app.table_visits.reindex()
+    app.visit_index.clear()
+    for visit in visits_table.values():
+        if visit.kkm_guid is None:
+            app.visit_index[visit.computer.lower()].add(
+                visit.track_id, visit.start_ts, visit.last_ts)
+    app.pending_receipts.clear()
+    for guid, receipt in pending_table.items():
+        app.pending_receipts[receipt['computer']].add(
+            guid, receipt['start'], receipt['end'])
+    # The receipts may have missed visit changes right before a crash.
+    app.pending_rescan = set(app.pending_receipts)
 
 
 @app.agent(KKM_TOPIC)
 async def process_kkm(stream):
+    stream = stream.group_by(
+        lambda kkm: kkm.computer.lower(), name='kkm-register')
     async for kkm in stream:
-        if kkm.computer == 'AP29Kassa1':
-            kkm.time_range = DateTimeRange(kkm.start_ts_iso, kkm.date)
-            kassa_tracks = app.table_visits.setdefault(
-                kkm.computer.lower(), [])
+        # Receipts replayed after a restart are matched or waiting already.
+        if kkm.computer == 'AP29Kassa1' and kkm.guid not in receipts_table \
+                and kkm.guid not in pending_table:
+            computer = kkm.computer.lower()
+            index = app.visit_index[computer]
             try:
-                if visit := max([v for v in kassa_tracks if kkm.time_range.is_intersection(v.time_range) and v.kkm_guid is None],
-                        key=lambda x: kkm.time_range.intersection(x.time_range).get_timedelta_second(), default=False):
-                    print(kkm.time_range.intersection(visit.time_range).get_timedelta_second())
-                    visit.kkm_guid = kkm.guid
-                    app.persist_table_visits[visit.track_id] = visit
-                    await db['vis']['vis'].replace_one({'_id': visit.db_id}, visit.asdict())
+                start, end = to_epoch(kkm.start_ts_iso), to_epoch(kkm.date)
+                match = index.best_overlap(start, end)
+                if match is not None:
+                    track_id, overlap, _ = match
+                    print(overlap)
+                    await assign_receipt(computer, kkm.guid, track_id)
+                else:
+                    # Its visit may not have been seen or extended yet.
+                    dropped = app.pending_receipts[computer].add(
+                        kkm.guid, start, end)
+                    if kkm.guid not in dropped:
+                        pending_table[kkm.guid] = {
+                            'computer': computer, 'start': start, 'end': end}
+                    for guid in dropped:
+                        pending_table.pop(guid, None)
+                await advance_register(computer, end)
             except Exception as exc:
                 print(exc)
 
 @app.agent(VISIT_TOPIC)
 async def process_visits(stream):
-    async for track_id, vis in stream.items():
-        vis.start_ts = localtz.localize(datetime.fromtimestamp(vis.start_ts))
-        vis.last_ts = localtz.localize(datetime.fromtimestamp(vis.last_ts))
-        
-        vis.time_range = DateTimeRange(vis.start_ts, vis.last_ts)
-        kassa_tracks = app.table_visits.setdefault(vis.computer.lower(), [])
-        h = True
-        for t in kassa_tracks:
-            if t.track_id == vis.track_id:
-                vis.last_ts = t.last_ts
-                vis.time_range = t.time_range
-                t = vis
-                h = False
-                db_vis = await db['vis']['vis'].insert_one(vis.asdict())
-                vis.db_id = db_vis.inserted_id
-        if h:
-            db_vis = await db['vis']['vis'].insert_one(vis.asdict())
-            vis.db_id = db_vis.inserted_id
-            kassa_tracks.append(vis)
+    stream = stream.group_by(
+        lambda vis: vis.computer.lower(), name='visit-register')
+    async for vis in stream:
+        vis.start_ts, vis.last_ts = int(vis.start_ts), int(vis.last_ts)
+        now = vis.last_ts
+        t = app.table_visits.get(visit_key(vis.computer, vis.track_id))
+        fields = vis.asdict()
+        if t is not None:
+            # A repeated visit must not undo what the tracks and receipts
+            # already recorded for it.
+            vis.last_ts = t.last_ts
+            fields.update(
+                last_ts=t.last_ts, state=t.state, kkm_guid=t.kkm_guid)
+        await visit_writer.put((vis.computer, vis.track_id), fields)
+        if t is None:
+            app.table_visits.put(vis)
+            if vis.kkm_guid is None:
+                computer = vis.computer.lower()
+                app.visit_index[computer].add(
+                    vis.track_id, vis.start_ts, vis.last_ts)
+                await match_pending(
+                    computer, app.pending_receipts[computer].overlapping(
+                        vis.start_ts, vis.last_ts))
+        await advance_register(vis.computer.lower(), now)
 
 @app.agent(TRACKS_TOPIC)
-async def process_tracks(stream):
+async def repartition_tracks(stream):
     async for track_id, track in stream.items():
-        local_last_ts = localtz.localize(datetime.fromtimestamp(track.last_ts))
-        
-        
-        kassa_tracks = app.table_visits.setdefault(track_id.decode(
-            encoding='UTF-8').lower().split('-')[0], [])
-        for e in (t for t in kassa_tracks if t.track_id == track.track_id):
-            e.last_ts = local_last_ts
-            e.time_range = DateTimeRange(e.start_ts, e.last_ts)
+        await TRACKS_BY_REGISTER.send(
+            key=track_id.decode(encoding='UTF-8').lower().split('-')[0],
+            value=track)
+
+
+@app.agent(TRACKS_BY_REGISTER)
+async def process_tracks(stream):
+    async for computer, track in stream.items():
+        computer = computer.decode(encoding='UTF-8')
+        e = app.table_visits.get(visit_key(computer, track.track_id))
+        if e is not None:
+            previous_ts = e.last_ts
+            unmatched = app.visit_index[computer].update_end(
+                track.track_id, track.last_ts)
+            e.last_ts = track.last_ts
             if track.state == 4:
               e.state = track.state
-              await db['vis']['vis'].replace_one({'_id': e.db_id}, e.asdict())
+              await visit_writer.put((e.computer, e.track_id), e.asdict())
+            app.table_visits.touch(e)
+            if unmatched and track.last_ts > previous_ts:
+                # Only receipts in the newly covered time can match now.
+                await match_pending(
+                    computer, app.pending_receipts[computer].overlapping(
+                        previous_ts, track.last_ts))
+        await advance_register(computer, track.last_ts)
+
+
+
+@app.task
+async def create_visit_indexes():
+    # Upserts look visits up by register and track_id.
+    await visit_writer.collection.create_index(
+        [('computer', 1), ('track_id', 1)])
+
+
+@app.timer(interval=VISIT_FLUSH_INTERVAL)
+async def flush_visits():
+    try:
+        await visit_writer.flush()
+    except Exception as exc:
+        print(f'Visit flush failed, {len(visit_writer)} pending: {exc}')
+
+
+@app.on_before_shutdown.connect
+async def flush_visits_on_shutdown(app, **kwargs):
+    await visit_writer.close()
+
 
+@app.page('/visits/')
+async def visit_gauges(web, request):
+    gauges = app.table_visits.gauges()
+    gauges['unmatched'] = {
+        computer: len(index) for computer, index in app.visit_index.items()}
+    gauges['pending_receipts'] = {
+        computer: len(pending)
+        for computer, pending in app.pending_receipts.items()}
+    gauges['dropped_receipts'] = sum(
+        pending.dropped for pending in app.pending_receipts.values())
+    return web.json(gauges)
 
 
 @app.timer(interval=10.0)
 async def every_10s():
     pass
     print(
-        f'Events/s :{app.monitor.events_s} | avg event runtime {app.monitor.events_runtime_avg*1000:.2f}ms \n {len(app.persist_table_visits)} ')
+        f'Events/s :{app.monitor.events_s} | avg event runtime {app.monitor.events_runtime_avg*1000:.2f}ms \n {len(receipts_table)} '
+        f'| visits {len(app.table_visits)}, expired {app.table_visits.expired} '
+        f'| receipts waiting {len(pending_table)} '
+        f'| visits pending {len(visit_writer)}, written {visit_writer.written} '
+        f'in {visit_writer.flushes} flushes')
 
 if __name__ == '__main__':
     app.main()
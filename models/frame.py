@@ -1,4 +1,6 @@
-from typing import Dict, List
+import base64
+import json
+from typing import Dict, List, NamedTuple
 
 import numpy as np
 from pydantic import BaseModel, Field  # pylint: disable=E0611
@@ -24,15 +26,28 @@ class Array(np.ndarray, metaclass=_ArrayMeta):
         else:
             shape = tuple()
 
-        result = np.array(val, dtype=dtype, copy=False, ndmin=len(shape))
-        assert not shape or len(shape) == len(
-            result.shape)  # ndmin guarantees this
+        if isinstance(val, (str, bytes)):
+            val = decode_tensor_data(val)
+        result = np.asarray(val, dtype=dtype)
+        if result.ndim < len(shape):
+            result = result.reshape(
+                (1,) * (len(shape) - result.ndim) + result.shape)
 
         if any((shape[i] != -1 and shape[i] != result.shape[i]) for i in range(len(shape))):
             result = result.reshape(shape)
         return result
 
 
+def decode_tensor_data(data):
+    """Tensor data as an array. `data` is either a list of floats or a base64
+    string of little-endian float32 bytes; the latter is decoded without
+    copying the buffer.
+    """
+    if isinstance(data, (str, bytes)):
+        return np.frombuffer(base64.b64decode(data), dtype='<f4')
+    return data
+
+
 class Tensor(BaseModel):
     confidence: int = None
     label_id: int = None
@@ -90,7 +105,7 @@ class Frame(BaseModel):
     source: str
     resolution: Resolution
     ts: int
-    objects: List[ROI] = Field(default_factory=list())
+    objects: List[ROI] = Field(default_factory=list)
 
     def get_bboxes(self):
         return [np.asarray([*[roi.__getattribute__(d) for d in ['x', 'y', 'w', 'h']], self.ts, roi.detection.confidence]) for roi in self.objects]
@@ -102,3 +117,54 @@ class Frame(BaseModel):
         bboxes = self.get_bboxes()
         features = self.get_features()
         return np.concatenate([bboxes, features], axis=1)
+
+    def to_batch(self, feature_name='face_id', feature_dim=256):
+        """Validated counterpart of `decode_frame`."""
+        return decode_frame(self.dict(), feature_name, feature_dim)
+
+
+class FrameBatch(NamedTuple):
+    """All detections of one frame in columnar form."""
+    computer: str
+    source: str
+    ts: int
+    boxes: np.ndarray  # (N, 4) int32 x, y, w, h
+    confidences: np.ndarray  # (N,) float32
+    features: np.ndarray  # (N, feature_dim) float32
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+def decode_frame(message, feature_name='face_id', feature_dim=256):
+    """Decode a gvametaconvert message into a `FrameBatch` without pydantic
+    validation. Only the boxes, detection confidences and the `feature_name`
+    tensor of every ROI are read, other tensors are skipped. ROIs without
+    that tensor are dropped, as they cannot be associated by appearance.
+    Tensor data may be a JSON float list or base64 float32, see
+    `decode_tensor_data`.
+
+    message: JSON bytes or str, or the already deserialized dict.
+    """
+    if isinstance(message, (bytes, bytearray, str)):
+        message = json.loads(message)
+    boxes, confidences, features = [], [], []
+    for roi in message.get('objects') or ():
+        for tensor in roi['tensors']:
+            if tensor['name'] == feature_name:
+                features.append(decode_tensor_data(tensor['data']))
+                break
+        else:
+            continue
+        boxes.append((roi['x'], roi['y'], roi['w'], roi['h']))
+        detection = roi.get('detection')
+        confidences.append(detection['confidence'] if detection else 0.)
+    # One conversion per column instead of one array per tensor.
+    return FrameBatch(
+        computer=message['tags']['computer'],
+        source=message['source'],
+        ts=int(message['ts']),
+        boxes=np.array(boxes, dtype=np.int32).reshape(-1, 4),
+        confidences=np.array(confidences, dtype=np.float32),
+        features=np.array(features, dtype=np.float32).reshape(
+            -1, feature_dim))
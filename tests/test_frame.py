@@ -0,0 +1,120 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from models.frame import Frame, decode_frame
+
+FEATURE_DIM = 8
+
+
+def make_message(n_objects, encoding='list', seed=0):
+    rng = np.random.RandomState(seed)
+    objects = []
+    for i in range(n_objects):
+        feature = rng.normal(size=FEATURE_DIM).astype(np.float32)
+        if encoding == 'base64':
+            data = base64.b64encode(feature.astype('<f4').tobytes()).decode()
+        else:
+            data = feature.tolist()
+        objects.append({
+            'x': int(rng.randint(0, 1000)),
+            'y': int(rng.randint(0, 1000)),
+            'w': int(rng.randint(10, 100)),
+            'h': int(rng.randint(10, 100)),
+            'detection': {
+                'bounding_box': {
+                    'x_max': 0.5, 'x_min': 0.1, 'y_max': 0.5, 'y_min': 0.1},
+                'confidence': float(rng.uniform()),
+                'label_id': 1,
+                'label': 'face',
+            },
+            'tensors': [
+                {'layout': 'ANY', 'name': 'age', 'precision': 'FP32',
+                 'data': [float(i)]},
+                {'layout': 'ANY', 'name': 'face_id', 'precision': 'FP32',
+                 'data': data},
+            ],
+            'id': i,
+            'roi_type': 'face',
+        })
+    return {
+        'tags': {'ap': 'ap29', 'computer': 'AP29Kassa1'},
+        'timestamp': '2020-12-04T10:00:00.000Z',
+        'source': 'rtsp://camera/1',
+        'resolution': {'height': 1080, 'width': 1920},
+        'ts': 1607076000,
+        'objects': objects,
+    }
+
+
+@pytest.mark.parametrize('encoding', ['list', 'base64'])
+def test_decode_frame_matches_raw_det(encoding):
+    raw = json.dumps(make_message(5, encoding))
+    batch = decode_frame(raw, feature_dim=FEATURE_DIM)
+    det = Frame.parse_raw(raw).get_raw_det()
+
+    np.testing.assert_array_equal(batch.boxes, det[:, 0:4])
+    assert (det[:, 4] == batch.ts).all()
+    np.testing.assert_array_equal(
+        batch.confidences, det[:, 5].astype(np.float32))
+    np.testing.assert_array_equal(batch.features, det[:, 6:])
+
+
+@pytest.mark.parametrize('encoding', ['list', 'base64'])
+def test_decode_frame_matches_validated_batch(encoding):
+    message = make_message(5, encoding)
+    batch = decode_frame(json.dumps(message), feature_dim=FEATURE_DIM)
+    validated = Frame(**message).to_batch(feature_dim=FEATURE_DIM)
+
+    assert (batch.computer, batch.source, batch.ts) == \
+        (validated.computer, validated.source, validated.ts)
+    for name in ('boxes', 'confidences', 'features'):
+        expected = getattr(validated, name)
+        actual = getattr(batch, name)
+        assert actual.dtype == expected.dtype
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_decode_frame_accepts_dict_and_bytes():
+    message = make_message(3)
+    expected = decode_frame(message, feature_dim=FEATURE_DIM)
+    for raw in (json.dumps(message), json.dumps(message).encode()):
+        batch = decode_frame(raw, feature_dim=FEATURE_DIM)
+        for name in ('boxes', 'confidences', 'features'):
+            np.testing.assert_array_equal(
+                getattr(batch, name), getattr(expected, name))
+
+
+@pytest.mark.parametrize('objects', [[], None, 'missing'])
+def test_empty_frame(objects):
+    message = make_message(0)
+    if objects == 'missing':
+        del message['objects']
+    else:
+        message['objects'] = objects
+    batch = decode_frame(json.dumps(message), feature_dim=FEATURE_DIM)
+    assert len(batch) == 0
+    assert batch.boxes.shape == (0, 4) and batch.boxes.dtype == np.int32
+    assert batch.confidences.shape == (0,)
+    assert batch.features.shape == (0, FEATURE_DIM)
+    assert batch.features.dtype == np.float32
+    if objects is not None:
+        validated = Frame(**message).to_batch(feature_dim=FEATURE_DIM)
+        for name in ('boxes', 'confidences', 'features'):
+            expected = getattr(validated, name)
+            assert getattr(batch, name).shape == expected.shape
+            assert getattr(batch, name).dtype == expected.dtype
+        assert len(Frame(**message).objects) == 0
+
+
+def test_rois_without_feature_are_dropped():
+    message = make_message(3)
+    del message['objects'][1]['tensors'][1]
+    batch = decode_frame(message, feature_dim=FEATURE_DIM)
+    assert len(batch) == 2
+    expected = decode_frame(
+        dict(message, objects=[message['objects'][i] for i in (0, 2)]),
+        feature_dim=FEATURE_DIM)
+    np.testing.assert_array_equal(batch.features, expected.features)
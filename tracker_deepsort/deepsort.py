@@ -1,8 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
 import numpy as np
-from .detection import Detection
+from .detection import DetectionBatch
+from .nms import non_max_suppression
 from .nn_matching import NearestNeighborDistanceMetric
+from .profiling import StageProfiler
+from .track import TrackState
 from .tracker import Tracker
 
 #tt = np.asarray([np.concatenate([np.asarray([*[roi.__getattribute__(d) for d in ['x', 'y', 'w', 'h']], roi.detection.confidence,
@@ -21,26 +24,81 @@ class DeepSort(object):
             features
         - nn_budget: Maximum size of the appeareance descriptors gallery. \
             If None, no budget is enforced.
+        - assignment_solver: Linear assignment backend, one of "scipy", \
+            "greedy" or "components", or a custom solver callable.
+        - gallery_storage: Element type of the appearance gallery, one of \
+            "float32", "float16" or "int8".
+        - profile: If True, record per-stage timings of every tracker \
+            update, see `stats`.
+        - nms_max_overlap: If not None, run non-maximum suppression with \
+            this overlap threshold before association; suppressed \
+            detections get track_id -1.
     '''
 
     def __init__(self, min_height=0, max_cosine_distance=0.2,
-                 nn_budget=None):
+                 nn_budget=None, assignment_solver="components",
+                 gallery_storage="float32", profile=False,
+                 nms_max_overlap=None):
         self._min_height = min_height
+        self._nms_max_overlap = nms_max_overlap
         self._max_cosine_distance = max_cosine_distance
         self._nn_budget = nn_budget
         
         metric = NearestNeighborDistanceMetric(
-            "cosine", self._max_cosine_distance, self._nn_budget
+            "cosine", self._max_cosine_distance, self._nn_budget,
+            storage=gallery_storage
         )
-        self._tracker = Tracker(metric)
+        self._profiler = StageProfiler() if profile else None
+        self._tracker = Tracker(metric, assignment_solver=assignment_solver,
+                                profiler=self._profiler)
         #super(DeepSort, self).__init__()
 
     def __call__(self):
         return self
     
+    def stats(self):
+        '''
+        - Returns:
+            - stats: (dict) p50/p95/p99 of every tracker stage in \
+                milliseconds and of the per-frame track, detection and \
+                match counts. Empty if profiling is disabled.
+        '''
+        if self._profiler is None:
+            return {}
+        return self._profiler.summary()
+
+    @property
+    def tracker(self):
+        return self._tracker
+
+    def snapshot(self):
+        '''
+        - Returns:
+            - snapshot: (bytes) tracker state, see `Tracker.snapshot`.
+        '''
+        return self._tracker.snapshot()
+
+    def restore(self, snapshot):
+        '''
+        - Arguments:
+            - snapshot: (bytes) output of `snapshot` of a DeepSort with the \
+                same settings.
+        '''
+        self._tracker.restore(snapshot)
+
     def update(self, detection_list):
+        '''
+        - Arguments:
+            - detection_list: DetectionBatch or List[Detection] of the \
+                current frame.
+
+        - Returns:
+            - (matches, unmatched_tracks, unmatched_detections) as returned \
+                by `Tracker.update`; track indices are slots of \
+                `tracker.table`.
+        '''
         self._tracker.predict()
-        self._tracker.update(detection_list)    
+        return self._tracker.update(detection_list)
 
     def process(self, bboxes):
         '''
@@ -52,34 +110,66 @@ class DeepSort(object):
             - tracks: (np.array) (nb_boxes, 5) \
                 Specifically (nb_boxes, [top, left, width, height, track_id])
         '''
-        detection_list = []
-        dets_to_bboxes_d = {}
-        dets_idx = -1
-        for idx, bbox_data in enumerate(bboxes):
-            bbox, ts, confidence, feature = bbox_data[0:
-                                                      4], bbox_data[4], bbox_data[5], bbox_data[6:]
-            if bbox[3] < self._min_height:
-                continue
-            detection_list.append(Detection(bbox, confidence, feature, ts, '', ''))
-            dets_idx += 1
-            dets_to_bboxes_d[dets_idx] = idx
-
-        to_return = np.concatenate(
-            [bboxes[:, 0:4], np.full((bboxes.shape[0], 1), -1)], axis=1)
+        bboxes = np.asarray(bboxes)
+        if bboxes.ndim != 2:
+            # e.g. a list of rows, or an empty list for a frame without
+            # detections.
+            bboxes = bboxes.reshape(len(bboxes), -1 if len(bboxes) else 6)
+        return self.process_arrays(
+            bboxes[:, 0:4], bboxes[:, 5], bboxes[:, 4], bboxes[:, 6:])
+
+    def process_arrays(self, tlwh, confidence, ts, features, out=None):
+        '''
+        Columnar variant of `process`. The inputs are used as views where \
+        their dtype allows it, no per-detection objects are built.
+
+        - Arguments:
+            - tlwh (np.array) (nb_boxes, 4) [top, left, width, height]
+            - confidence (np.array) (nb_boxes,) or scalar
+            - ts (np.array) (nb_boxes,) or scalar frame unixtime
+            - features (np.array) (nb_boxes, feature_dim)
+            - out (np.array) (>= nb_boxes, 5) int32, optional buffer that \
+                receives the result.
+
+        - Returns:
+            - tracks: (np.array) (nb_boxes, 5) int32 view of `out` \
+                Specifically (nb_boxes, [top, left, width, height, track_id]), \
+                track_id is -1 for detections without a confirmed track.
+        '''
+        tlwh = np.asarray(tlwh)
+        n = len(tlwh)
+        if out is None:
+            out = np.empty((n, 5), dtype=np.int32)
+        out = out[:n]
+        out[:, 0:4] = tlwh
+        out[:, 4] = -1
+
+        detections = DetectionBatch(tlwh, confidence, features, ts)
+        kept = None
+        if self._min_height > 0:
+            kept = np.flatnonzero(detections.tlwh[:, 3] >= self._min_height)
+        if self._nms_max_overlap is not None:
+            candidates = np.arange(n) if kept is None else kept
+            kept = np.sort(candidates[non_max_suppression(
+                detections.tlwh[candidates], self._nms_max_overlap,
+                detections.confidence[candidates])])
+        if kept is not None:
+            detections = DetectionBatch(
+                detections.tlwh[kept], detections.confidence[kept],
+                detections.feature[kept], detections.ts[kept])
         self._tracker.predict()
-        matches, _, unmatched_dets = self._tracker.update(detection_list)
-        tracks_to_dets_d = dict(matches)
-
-        for idx, track in enumerate(self._tracker.tracks):
-            if not track.is_confirmed() or track.time_since_update > 1:
-                continue
-            bbox = track.to_tlwh()
-            new_box = np.array(
-                [bbox[0], bbox[1], bbox[2], bbox[3], track.track_id], np.int32)
-            box_idx = dets_to_bboxes_d.get(
-                tracks_to_dets_d.get(idx, None), None)
-            if box_idx is not None:
-                to_return[box_idx] = new_box
+        matches, _, _ = self._tracker.update(detections)
+        if len(matches) == 0:
+            return out
 
-        
-        return np.array(to_return, np.int32)
+        # Track indices are slots of the track table and stay valid after
+        # the update, matched tracks are never removed.
+        table = self._tracker.table
+        slots, det_indices = map(np.asarray, zip(*matches))
+        confirmed = table.state[slots] == TrackState.Confirmed
+        slots, det_indices = slots[confirmed], det_indices[confirmed]
+        if kept is not None:
+            det_indices = kept[det_indices]
+        out[det_indices, 0:4] = table.to_tlwh(slots)
+        out[det_indices, 4] = table.track_id[slots]
+        return out
@@ -1,9 +1,11 @@
 import numpy as np
 
 
-class Detection:
+class Detection(object):
     """
-    This class represents a bounding box detection in a single image.
+    This class represents a bounding box detection in a single image. Box
+    conversions are computed on first use and cached; the returned arrays
+    are read-only.
     Parameters
     ----------
     tlwh : array_like
@@ -25,26 +27,118 @@ class Detection:
     ts : int
         Frame Unix timestamp 
     """
+    __slots__ = ('tlwh', 'confidence', 'feature', 'ts', '_tlbr', '_xyah')
 
     def __init__(self, tlwh, confidence, feature, ts):
-        self.tlwh = np.asarray(tlwh, dtype=np.float)
+        self.tlwh = np.asarray(tlwh, dtype=np.float64)
         self.confidence = float(confidence)
         self.feature = np.asarray(feature, dtype=np.float32)
         self.ts = int(ts)
+        self._tlbr = None
+        self._xyah = None
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
         `(top left, bottom right)`.
         """
-        ret = self.tlwh.copy()
-        ret[2:] += ret[:2]
-        return ret
+        if self._tlbr is None:
+            ret = self.tlwh.copy()
+            ret[2:] += ret[:2]
+            ret.flags.writeable = False
+            self._tlbr = ret
+        return self._tlbr
 
     def to_xyah(self):
         """Convert bounding box to format `(center x, center y, aspect ratio,
         height)`, where the aspect ratio is `width / height`.
         """
-        ret = self.tlwh.copy()
-        ret[:2] += ret[2:] / 2
-        ret[2] /= ret[3]
-        return ret
+        if self._xyah is None:
+            ret = self.tlwh.copy()
+            ret[:2] += ret[2:] / 2
+            ret[2] /= ret[3]
+            ret.flags.writeable = False
+            self._xyah = ret
+        return self._xyah
+
+
+class DetectionBatch(object):
+    """
+    All detections of a single image in columnar form. Arrays that already
+    have the target dtype are used as views, no per-detection objects are
+    created. Box conversions are computed once and cached like in
+    `Detection`.
+    Parameters
+    ----------
+    tlwh : array_like
+        The Nx4 matrix of bounding boxes in format `(x, y, w, h)`.
+    confidence : array_like
+        Detector confidence scores, one per detection or a scalar.
+    feature : array_like
+        The NxM matrix of feature vectors.
+    ts : array_like
+        Frame Unix timestamps, one per detection or a scalar.
+    Attributes
+    ----------
+    tlwh : ndarray
+        The Nx4 float matrix of bounding boxes in format
+        `(top left x, top left y, width, height)`.
+    confidence : ndarray
+        Detector confidence scores.
+    feature : ndarray
+        The NxM float32 matrix of feature vectors.
+    ts : ndarray
+        Frame Unix timestamps.
+    """
+    __slots__ = ('tlwh', 'confidence', 'feature', 'ts', '_tlbr', '_xyah')
+
+    def __init__(self, tlwh, confidence, feature, ts):
+        self.tlwh = np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)
+        n = len(self.tlwh)
+        self.confidence = np.broadcast_to(
+            np.asarray(confidence, dtype=np.float64), (n,))
+        feature = np.asarray(feature, dtype=np.float32)
+        if feature.ndim != 2:
+            feature = feature.reshape((n, -1) if n > 0 else (0, 0))
+        self.feature = feature
+        self.ts = np.broadcast_to(np.asarray(ts, dtype=np.int64), (n,))
+        self._tlbr = None
+        self._xyah = None
+
+    @classmethod
+    def from_detections(cls, detections):
+        """Stack a list of `Detection` objects into a batch."""
+        if len(detections) == 0:
+            return cls(np.empty((0, 4)), (), (), ())
+        return cls([d.tlwh for d in detections],
+                   [d.confidence for d in detections],
+                   [d.feature for d in detections],
+                   [d.ts for d in detections])
+
+    def __len__(self):
+        return len(self.tlwh)
+
+    def __getitem__(self, index):
+        return Detection(self.tlwh[index], self.confidence[index],
+                         self.feature[index], self.ts[index])
+
+    def to_tlbr(self):
+        """Convert bounding boxes to format `(min x, min y, max x, max y)`.
+        """
+        if self._tlbr is None:
+            ret = self.tlwh.copy()
+            ret[:, 2:] += ret[:, :2]
+            ret.flags.writeable = False
+            self._tlbr = ret
+        return self._tlbr
+
+    def to_xyah(self):
+        """Convert bounding boxes to format `(center x, center y, aspect
+        ratio, height)`, where the aspect ratio is `width / height`.
+        """
+        if self._xyah is None:
+            ret = self.tlwh.copy()
+            ret[:, :2] += ret[:, 2:] / 2
+            ret[:, 2] /= ret[:, 3]
+            ret.flags.writeable = False
+            self._xyah = ret
+        return self._xyah
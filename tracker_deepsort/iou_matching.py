@@ -1,6 +1,58 @@
 from __future__ import absolute_import
 import numpy as np
 from . import linear_assignment
+from .detection import DetectionBatch
+
+
+def intersection_matrix(bboxes, candidates):
+    """Compute pair-wise intersection areas.
+    Parameters
+    ----------
+    bboxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Mx4 matrix of bounding boxes in the same format as `bboxes`.
+    Returns
+    -------
+    ndarray
+        Returns a matrix of size len(bboxes), len(candidates) such that
+        element (i, j) contains the area of the intersection of `bboxes[i]`
+        and `candidates[j]`.
+    """
+    bboxes_tl = bboxes[:, np.newaxis, :2]
+    bboxes_br = bboxes_tl + bboxes[:, np.newaxis, 2:]
+    candidates_tl = candidates[np.newaxis, :, :2]
+    candidates_br = candidates_tl + candidates[np.newaxis, :, 2:]
+
+    wh = np.minimum(bboxes_br, candidates_br) - \
+        np.maximum(bboxes_tl, candidates_tl)
+    np.maximum(wh, 0., out=wh)
+    return wh[..., 0] * wh[..., 1]
+
+
+def iou_matrix(bboxes, candidates):
+    """Compute pair-wise intersection over union.
+    Parameters
+    ----------
+    bboxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Mx4 matrix of bounding boxes in the same format as `bboxes`.
+    Returns
+    -------
+    ndarray
+        Returns a matrix of size len(bboxes), len(candidates) such that
+        element (i, j) contains the intersection over union in [0, 1] between
+        `bboxes[i]` and `candidates[j]`.
+    """
+    area_intersection = intersection_matrix(bboxes, candidates)
+    area_bboxes = bboxes[:, 2] * bboxes[:, 3]
+    area_candidates = candidates[:, 2] * candidates[:, 3]
+    return area_intersection / (
+        area_bboxes[:, np.newaxis] + area_candidates[np.newaxis, :] -
+        area_intersection)
 
 
 def iou(bbox, candidates):
@@ -19,20 +71,7 @@ def iou(bbox, candidates):
         candidate. A higher score means a larger fraction of the `bbox` is
         occluded by the candidate.
     """
-    bbox_tl, bbox_br = bbox[:2], bbox[:2] + bbox[2:]
-    candidates_tl = candidates[:, :2]
-    candidates_br = candidates[:, :2] + candidates[:, 2:]
-
-    tl = np.c_[np.maximum(bbox_tl[0], candidates_tl[:, 0])[:, np.newaxis],
-               np.maximum(bbox_tl[1], candidates_tl[:, 1])[:, np.newaxis]]
-    br = np.c_[np.minimum(bbox_br[0], candidates_br[:, 0])[:, np.newaxis],
-               np.minimum(bbox_br[1], candidates_br[:, 1])[:, np.newaxis]]
-    wh = np.maximum(0., br - tl)
-
-    area_intersection = wh.prod(axis=1)
-    area_bbox = bbox[2:].prod()
-    area_candidates = candidates[:, 2:].prod(axis=1)
-    return area_intersection / (area_bbox + area_candidates - area_intersection)
+    return iou_matrix(np.asarray(bbox)[np.newaxis, :], candidates)[0]
 
 
 def iou_cost(tracks, detections, track_indices=None,
@@ -40,13 +79,13 @@ def iou_cost(tracks, detections, track_indices=None,
     """An intersection over union distance metric.
     Parameters
     ----------
-    tracks : List[deep_sort.track.Track]
-        A list of tracks.
-    detections : List[deep_sort.detection.Detection]
-        A list of detections.
+    tracks : track_table.TrackTable
+        The table of tracks.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections.
     track_indices : Optional[List[int]]
-        A list of indices to tracks that should be matched. Defaults to
-        all `tracks`.
+        A list of slots of tracks that should be matched. Defaults to
+        all live `tracks`.
     detection_indices : Optional[List[int]]
         A list of indices to detections that should be matched. Defaults
         to all `detections`.
@@ -58,17 +97,23 @@ def iou_cost(tracks, detections, track_indices=None,
         `1 - iou(tracks[track_indices[i]], detections[detection_indices[j]])`.
     """
     if track_indices is None:
-        track_indices = np.arange(len(tracks))
+        track_indices = tracks.live_slots()
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
+    track_indices = np.asarray(track_indices, dtype=int)
+    cost_matrix = np.full(
+        (len(track_indices), len(detection_indices)),
+        linear_assignment.INFTY_COST)
+    fresh = tracks.time_since_update[track_indices] <= 1
+    if not fresh.any() or len(detection_indices) == 0:
+        return cost_matrix
 
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    bboxes = tracks.to_tlwh(track_indices[fresh])
+    if isinstance(detections, DetectionBatch):
+        candidates = detections.tlwh[detection_indices]
+    else:
+        candidates = np.asarray(
+            [detections[i].tlwh for i in detection_indices])
+    cost_matrix[fresh] = 1. - iou_matrix(bboxes, candidates)
     return cost_matrix
\ No newline at end of file
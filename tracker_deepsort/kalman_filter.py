@@ -203,4 +203,137 @@ class KalmanFilter(object):
             cholesky_factor, d.T, lower=True, check_finite=False,
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
-        return squared_maha
\ No newline at end of file
+        return squared_maha
+
+    def multi_predict(self, mean, covariance):
+        """Run Kalman filter prediction step for a batch of tracks.
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of object state means at the previous
+            time step.
+        covariance : ndarray
+            The Nx8x8 dimensional stack of object state covariances at the
+            previous time step.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean matrix and covariance stack of the predicted
+            states, equivalent to calling `predict` on every row.
+        """
+        height = mean[:, 3]
+        std = np.empty((len(mean), 8))
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = self._std_weight_velocity * height[:, np.newaxis]
+        std[:, 6] = 1e-5
+        motion_cov = _batch_diag(np.square(std))
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._motion_mat, covariance),
+            self._motion_mat.T) + motion_cov
+
+        return mean, covariance
+
+    def multi_project(self, mean, covariance):
+        """Project a batch of state distributions to measurement space.
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariance : ndarray
+            The Nx8x8 dimensional stack of state covariances.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariances.
+        """
+        height = mean[:, 3]
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-1
+        innovation_cov = _batch_diag(np.square(std))
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
+    def multi_update(self, mean, covariance, measurements):
+        """Run Kalman filter correction step for a batch of tracks.
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of predicted state means.
+        covariance : ndarray
+            The Nx8x8 dimensional stack of predicted state covariances.
+        measurements : ndarray
+            The Nx4 dimensional matrix of measurements (x, y, a, h), where row
+            i is associated with the i-th state.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        # The projected covariances are symmetric, hence solving
+        # S K^T = (P H^T)^T yields the transposed Kalman gain.
+        kalman_gain = np.linalg.solve(
+            projected_cov,
+            np.matmul(covariance, self._update_mat.T).transpose(0, 2, 1)
+        ).transpose(0, 2, 1)
+        innovation = measurements - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov),
+            kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute gating distances between a batch of state distributions and
+        measurements. See `gating_distance` for the meaning of the distance
+        and the choice of threshold.
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariance : ndarray
+            The Nx8x8 dimensional stack of state covariances.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between the i-th state distribution and
+            `measurements[j]`.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        squared_maha = np.sum(z * z, axis=1)
+        return squared_maha
+
+
+def _batch_diag(diagonals):
+    """Build a stack of diagonal matrices from the rows of `diagonals`."""
+    n, ndim = diagonals.shape
+    result = np.zeros((n, ndim, ndim))
+    idx = np.arange(ndim)
+    result[:, idx, idx] = diagonals
+    return result
@@ -1,15 +1,225 @@
 from __future__ import absolute_import
+import concurrent.futures
 import numpy as np
-from sklearn.utils.linear_assignment_ import linear_assignment #TODO: replace  https://stackoverflow.com/questions/57369848/how-do-i-resolve-use-scipy-optimize-linear-sum-assignment-instead
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
 from . import kalman_filter
+from .detection import DetectionBatch
+from .profiling import NULL_PROFILER
 
 
 INFTY_COST = 1e+5
 
 
+def _scipy_assignment(cost_matrix, max_distance):
+    """Solve the full assignment problem with the Hungarian algorithm
+    implementation of `scipy.optimize.linear_sum_assignment`.
+    """
+    return scipy.optimize.linear_sum_assignment(cost_matrix)
+
+
+def _greedy_assignment(cost_matrix, max_distance):
+    """Repeatedly assign the cheapest pair of free rows and columns whose cost
+    does not exceed `max_distance`. Not optimal, but runs in O(K log K) for K
+    feasible entries and is meant for very large, sparse problems.
+    """
+    rows, cols = np.nonzero(cost_matrix <= max_distance)
+    order = np.argsort(cost_matrix[rows, cols], kind='stable')
+    used_rows, used_cols = set(), set()
+    row_indices, col_indices = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        row_indices.append(row)
+        col_indices.append(col)
+    return (np.asarray(row_indices, dtype=int),
+            np.asarray(col_indices, dtype=int))
+
+
+def gated_cost_graph(cost_matrix, max_distance):
+    """Build the sparse bipartite graph of feasible associations.
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix.
+    max_distance : float
+        Gating threshold. Entries with larger cost are not part of the graph.
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        An NxM sparse matrix that holds the cost of every feasible entry.
+        Feasible entries of zero cost are stored as explicit zeros.
+    """
+    rows, cols = np.nonzero(cost_matrix <= max_distance)
+    return scipy.sparse.csr_matrix(
+        (cost_matrix[rows, cols], (rows, cols)), shape=cost_matrix.shape)
+
+
+def connected_blocks(graph):
+    """Split a sparse bipartite graph into independent assignment problems.
+    Parameters
+    ----------
+    graph : scipy.sparse.spmatrix
+        An NxM sparse matrix of feasible associations, e.g. the output of
+        `gated_cost_graph`.
+    Returns
+    -------
+    (ndarray, ndarray)
+        Component labels of all N rows and M columns. Rows and columns with
+        the same label form an independent assignment problem. Rows and
+        columns without feasible entries are labelled -1.
+    """
+    n_rows, n_cols = graph.shape
+    graph = scipy.sparse.coo_matrix(graph)
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(graph.nnz), (graph.row, n_rows + graph.col)),
+        shape=(n_rows + n_cols, n_rows + n_cols)).tocsr()
+    _, labels = scipy.sparse.csgraph.connected_components(
+        adjacency, directed=False)
+    degree = np.bincount(graph.row, minlength=n_rows)
+    degree = np.r_[degree, np.bincount(graph.col, minlength=n_cols)]
+    labels[degree == 0] = -1
+    return labels[:n_rows], labels[n_rows:]
+
+
+class ComponentAssignment(object):
+    """
+    Assignment solver that decomposes the gated cost matrix into connected
+    components of feasible entries and solves every component on its own.
+    Entries outside the gate all carry the same cost, hence the union of the
+    per-block optima is an optimum of the full problem. Solving time grows
+    with the size of the largest block, i.e. with local crowd density, rather
+    than with the total number of tracks times detections.
+    Parameters
+    ----------
+    dense_max_size : int
+        Problems with at most this many entries (rows x columns) are solved
+        densely in one call. Below a few hundred tracks the compiled dense
+        solver is faster than building and splitting the graph.
+    max_workers : Optional[int]
+        If not None, blocks with at least `pool_min_size` entries are solved
+        in a process pool with this many workers.
+    pool_min_size : int
+        Minimum number of entries (rows x columns) of a block before it is
+        sent to the process pool. Smaller blocks are solved inline, where the
+        inter-process overhead would dominate.
+    """
+
+    def __init__(self, dense_max_size=250000, max_workers=None,
+                 pool_min_size=250000):
+        self.dense_max_size = dense_max_size
+        self.max_workers = max_workers
+        self.pool_min_size = pool_min_size
+        self._pool = None
+
+    def __call__(self, cost_matrix, max_distance):
+        if cost_matrix.size <= self.dense_max_size:
+            return scipy.optimize.linear_sum_assignment(cost_matrix)
+
+        row_labels, col_labels = connected_blocks(
+            gated_cost_graph(cost_matrix, max_distance))
+        n_labels = max(row_labels.max(initial=-1),
+                       col_labels.max(initial=-1)) + 1
+        # The trailing zero count is picked up by the label -1.
+        rows_per_label = np.append(np.bincount(
+            row_labels[row_labels >= 0], minlength=n_labels), 0)
+        cols_per_label = np.append(np.bincount(
+            col_labels[col_labels >= 0], minlength=n_labels), 0)
+
+        # A component with a single row (column) is solved by taking the
+        # cheapest entry of that row (column). Gated entries cost more than
+        # any feasible one, so the minimum lies inside the component.
+        single_rows = np.flatnonzero(rows_per_label[row_labels] == 1)
+        single_cols = np.flatnonzero(
+            (cols_per_label[col_labels] == 1) &
+            (rows_per_label[col_labels] > 1))
+        row_indices = [single_rows, np.argmin(
+            cost_matrix[:, single_cols], axis=0)]
+        col_indices = [np.argmin(cost_matrix[single_rows], axis=1),
+                       single_cols]
+
+        # Larger components need a full assignment solve.
+        is_block = (rows_per_label > 1) & (cols_per_label > 1)
+        block_rows = _group_by_label(row_labels, is_block)
+        block_cols = _group_by_label(col_labels, is_block)
+        pending = []
+        for rows, cols in zip(block_rows, block_cols):
+            block = cost_matrix[np.ix_(rows, cols)]
+            if self.max_workers is not None and \
+                    block.size >= self.pool_min_size:
+                pending.append((rows, cols, self._executor().submit(
+                    scipy.optimize.linear_sum_assignment, block)))
+                continue
+            r, c = scipy.optimize.linear_sum_assignment(block)
+            row_indices.append(rows[r])
+            col_indices.append(cols[c])
+        for rows, cols, future in pending:
+            r, c = future.result()
+            row_indices.append(rows[r])
+            col_indices.append(cols[c])
+        return np.concatenate(row_indices), np.concatenate(col_indices)
+
+    def close(self):
+        """Shut down the process pool, if one has been started."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers)
+        return self._pool
+
+
+def _group_by_label(labels, selected):
+    """Returns the indices of `labels` grouped by label, in ascending label
+    order, for all labels where `selected` is True.
+    """
+    indices = np.flatnonzero(selected[labels])
+    indices = indices[np.argsort(labels[indices], kind='stable')]
+    bounds = np.flatnonzero(np.diff(labels[indices])) + 1
+    return np.split(indices, bounds) if len(indices) > 0 else []
+
+
+ASSIGNMENT_SOLVERS = {
+    "scipy": _scipy_assignment,
+    "greedy": _greedy_assignment,
+    "components": ComponentAssignment(),
+}
+
+
+def get_assignment_solver(solver):
+    """Look up an assignment solver backend.
+    Parameters
+    ----------
+    solver : str | Callable[ndarray, float] -> (ndarray, ndarray)
+        Either the name of a backend in `ASSIGNMENT_SOLVERS` ("scipy",
+        "greedy" or "components") or a callable, e.g. a configured
+        `ComponentAssignment`, that is given the NxM cost matrix and the
+        gating threshold and returns the row and column indices of the
+        assigned pairs.
+    Returns
+    -------
+    Callable[ndarray, float] -> (ndarray, ndarray)
+        The solver function.
+    """
+    if callable(solver):
+        return solver
+    try:
+        return ASSIGNMENT_SOLVERS[solver]
+    except KeyError:
+        raise ValueError(
+            "Invalid assignment solver; must be one of %s" %
+            ", ".join(repr(name) for name in ASSIGNMENT_SOLVERS))
+
+
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
-        detection_indices=None):
+        detection_indices=None, solver="scipy"):
     """Solve linear assignment problem.
     Parameters
     ----------
@@ -22,16 +232,18 @@ def min_cost_matching(
     max_distance : float
         Gating threshold. Associations with cost larger than this value are
         disregarded.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track_table.TrackTable
+        The table of predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
-        List of track indices that maps rows in `cost_matrix` to tracks in
+        List of track slots that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
     detection_indices : List[int]
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above).
+    solver : Optional[str | Callable]
+        The assignment solver backend, see `get_assignment_solver`.
     Returns
     -------
     (List[(int, int)], List[int], List[int])
@@ -41,7 +253,7 @@ def min_cost_matching(
         * A list of unmatched detection indices.
     """
     if track_indices is None:
-        track_indices = np.arange(len(tracks))
+        track_indices = tracks.live_slots()
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
@@ -51,28 +263,29 @@ def min_cost_matching(
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_assignment(cost_matrix)
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
-    for row, col in indices:
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    row_indices, col_indices = get_assignment_solver(solver)(
+        cost_matrix, max_distance)
+    feasible = cost_matrix[row_indices, col_indices] <= max_distance
+    row_indices, col_indices = row_indices[feasible], col_indices[feasible]
+
+    track_indices = np.asarray(track_indices, dtype=int)
+    detection_indices = np.asarray(detection_indices, dtype=int)
+    matched_rows = np.zeros(len(track_indices), dtype=bool)
+    matched_rows[row_indices] = True
+    matched_cols = np.zeros(len(detection_indices), dtype=bool)
+    matched_cols[col_indices] = True
+
+    matches = list(zip(track_indices[row_indices].tolist(),
+                       detection_indices[col_indices].tolist()))
+    unmatched_tracks = track_indices[~matched_rows].tolist()
+    unmatched_detections = detection_indices[~matched_cols].tolist()
     return matches, unmatched_tracks, unmatched_detections
 
 
 def matching_cascade(
         distance_metric, max_distance, cascade_depth, tracks, detections,
-        track_indices=None, detection_indices=None):
+        track_indices=None, detection_indices=None, solver="scipy",
+        profiler=None):
     """Run matching cascade.
     Parameters
     ----------
@@ -87,17 +300,22 @@ def matching_cascade(
         disregarded.
     cascade_depth: int
         The cascade depth, should be se to the maximum track age.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track_table.TrackTable
+        The table of predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : Optional[List[int]]
-        List of track indices that maps rows in `cost_matrix` to tracks in
-        `tracks` (see description above). Defaults to all tracks.
+        List of track slots that maps rows in `cost_matrix` to tracks in
+        `tracks` (see description above). Defaults to all live tracks.
     detection_indices : Optional[List[int]]
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above). Defaults to all
         detections.
+    solver : Optional[str | Callable]
+        The assignment solver backend, see `get_assignment_solver`.
+    profiler : Optional[profiling.StageProfiler]
+        If given, the time spent in every cascade level is recorded as stage
+        `cascade_level_<n>`.
     Returns
     -------
     (List[(int, int)], List[int], List[int])
@@ -106,36 +324,39 @@ def matching_cascade(
         * A list of unmatched track indices.
         * A list of unmatched detection indices.
     """
+    if profiler is None:
+        profiler = NULL_PROFILER
     if track_indices is None:
-        track_indices = list(range(len(tracks)))
+        track_indices = tracks.live_slots()
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
+    track_indices = np.asarray(track_indices, dtype=int)
+    track_levels = tracks.time_since_update[track_indices]
     unmatched_detections = detection_indices
     matches = []
     for level in range(cascade_depth):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
+        track_indices_l = track_indices[track_levels == 1 + level]
         if len(track_indices_l) == 0:  # Nothing to match at this level
             continue
 
-        matches_l, _, unmatched_detections = \
-            min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
-                track_indices_l, unmatched_detections)
+        with profiler.stage('cascade_level_%d' % (1 + level)):
+            matches_l, _, unmatched_detections = \
+                min_cost_matching(
+                    distance_metric, max_distance, tracks, detections,
+                    track_indices_l, unmatched_detections, solver)
         matches += matches_l
-    unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
+    unmatched_tracks = list(
+        set(track_indices.tolist()) - set(k for k, _ in matches))
     return matches, unmatched_tracks, unmatched_detections
 
 
 def gate_cost_matrix(
         kf, cost_matrix, tracks, detections, track_indices, detection_indices,
-        gated_cost=INFTY_COST, only_position=False):
+        gated_cost=INFTY_COST, only_position=False, measurements=None):
     """Invalidate infeasible entries in cost matrix based on the state
     distributions obtained by Kalman filtering.
     Parameters
@@ -146,10 +367,10 @@ def gate_cost_matrix(
         and M is the number of detection indices, such that entry (i, j) is the
         association cost between `tracks[track_indices[i]]` and
         `detections[detection_indices[j]]`.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    tracks : track_table.TrackTable
+        The table of predicted tracks at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
@@ -162,6 +383,9 @@ def gate_cost_matrix(
     only_position : Optional[bool]
         If True, only the x, y position of the state distribution is considered
         during gating. Defaults to False.
+    measurements : Optional[ndarray]
+        The Mx4 matrix of detections in `detection_indices` in format
+        `(x, y, a, h)`. Computed from `detections` if None.
     Returns
     -------
     ndarray
@@ -169,11 +393,13 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    if measurements is None and isinstance(detections, DetectionBatch):
+        measurements = detections.to_xyah()[detection_indices]
+    elif measurements is None:
+        measurements = np.asarray(
+            [detections[i].to_xyah() for i in detection_indices])
+    gating_distance = kf.multi_gating_distance(
+        tracks.mean[track_indices], tracks.covariance[track_indices],
+        measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
     return cost_matrix
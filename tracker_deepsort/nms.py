@@ -1,9 +1,15 @@
 import numpy as np
+from .iou_matching import intersection_matrix, iou_matrix
+
+
+_MATRIX_MAX_BOXES = 512
 
 
 def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     """Suppress overlapping detections.
     Original code from [1]_ has been adapted to include confidence score.
+    For up to a few hundred boxes the pairwise overlaps are computed once and
+    suppression is a single sweep over a boolean mask in score order.
     .. [1] http://www.pyimagesearch.com/2015/02/16/
            faster-non-maximum-suppression-python/
     Examples
@@ -17,7 +23,8 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     boxes : ndarray
         Array of ROIs (x, y, width, height).
     max_bbox_overlap : float
-        ROIs that overlap more than this values are suppressed.
+        ROIs that overlap more than this values are suppressed. The overlap
+        is the intersection divided by the area of the suppressed ROI.
     scores : Optional[array_like]
         Detector confidence score.
     Returns
@@ -28,37 +35,130 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     if len(boxes) == 0:
         return []
 
-    boxes = boxes.astype(np.float)
-    pick = []
+    boxes = np.array(boxes, dtype=np.float64)
 
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2] + boxes[:, 0]
+    # Boxes are treated as inclusive pixel ranges as in [1]_, i.e. a box
+    # covers width + 1 by height + 1 pixels.
+    boxes[:, 2:] += 1
     y2 = boxes[:, 3] + boxes[:, 1]
-
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    area = boxes[:, 2] * boxes[:, 3]
     if scores is not None:
-        idxs = np.argsort(scores)
+        order = np.argsort(scores)[::-1]
     else:
-        idxs = np.argsort(y2)
+        order = np.argsort(y2)[::-1]
+
+    # Small problems precompute all overlaps in one call and sweep a mask in
+    # score order. For large ones the quadratic matrix costs more than
+    # computing overlaps of every kept box against the shrinking remainder.
+    if len(boxes) > _MATRIX_MAX_BOXES:
+        x1, y1 = boxes[:, 0], boxes[:, 1]
+        x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+        pick = []
+        remaining = order
+        while len(remaining) > 0:
+            i, remaining = remaining[0], remaining[1:]
+            pick.append(int(i))
+            w = np.minimum(x2[i], x2[remaining]) - \
+                np.maximum(x1[i], x1[remaining])
+            h = np.minimum(y2[i], y2[remaining]) - \
+                np.maximum(y1[i], y1[remaining])
+            overlap = np.maximum(w, 0.) * np.maximum(h, 0.) / area[remaining]
+            remaining = remaining[overlap <= max_bbox_overlap]
+        return pick
 
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
+    suppresses = intersection_matrix(boxes, boxes) / area > max_bbox_overlap
+    pick = []
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    for i in order.tolist():
+        if suppressed[i]:
+            continue
         pick.append(i)
+        suppressed |= suppresses[i]
+    return pick
 
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
 
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
+def soft_non_max_suppression(boxes, scores, sigma=0.5, iou_threshold=0.3,
+                             score_threshold=0.001, method="gaussian"):
+    """Soft non-maximum suppression [2]_. Instead of removing detections that
+    overlap a higher scoring one, their scores are decayed by the overlap.
+    .. [2] Bodla et al., Soft-NMS -- Improving Object Detection With One Line
+           of Code, ICCV 2017.
+    Parameters
+    ----------
+    boxes : ndarray
+        Array of ROIs (x, y, width, height).
+    scores : array_like
+        Detector confidence score.
+    sigma : float
+        Width of the gaussian decay `exp(-iou^2 / sigma)`.
+    iou_threshold : float
+        With the linear method, scores of detections whose intersection over
+        union exceeds this value are multiplied by `1 - iou`.
+    score_threshold : float
+        Detections whose decayed score drops below this value are removed.
+    method : str
+        Either "gaussian" or "linear".
+    Returns
+    -------
+    (List[int], ndarray)
+        Indices of the surviving detections in order of selection and their
+        decayed scores.
+    """
+    if method not in ("gaussian", "linear"):
+        raise ValueError(
+            "Invalid method; must be either 'gaussian' or 'linear'")
+    if len(boxes) == 0:
+        return [], np.zeros(0)
 
-        overlap = (w * h) / area[idxs[:last]]
+    boxes = np.asarray(boxes, dtype=np.float64)
+    iou = iou_matrix(boxes, boxes)
+    if method == "gaussian":
+        decay = np.exp(-np.square(iou) / sigma)
+    else:
+        decay = np.where(iou > iou_threshold, 1. - iou, 1.)
+
+    scores = np.array(scores, dtype=np.float64)
+    remaining = scores >= score_threshold
+    pick = []
+    while remaining.any():
+        i = int(np.argmax(np.where(remaining, scores, -np.inf)))
+        pick.append(i)
+        remaining[i] = False
+        scores[remaining] *= decay[i, remaining]
+        remaining &= scores >= score_threshold
+    return pick, scores[pick]
 
-        idxs = np.delete(
-            idxs, np.concatenate(
-                ([last], np.where(overlap > max_bbox_overlap)[0])))
 
-    return pick
\ No newline at end of file
+def batched_non_max_suppression(boxes, max_bbox_overlap, groups, scores=None):
+    """Run `non_max_suppression` independently on every group of boxes,
+    e.g. on the detections of many frames at once or per object class.
+    Parameters
+    ----------
+    boxes : ndarray
+        Array of ROIs (x, y, width, height) of all groups.
+    max_bbox_overlap : float
+        ROIs that overlap more than this values are suppressed.
+    groups : array_like
+        Group label (frame index, class id) of every ROI. Only ROIs with the
+        same label suppress each other.
+    scores : Optional[array_like]
+        Detector confidence score.
+    Returns
+    -------
+    ndarray
+        Sorted indices of the detections that have survived.
+    """
+    groups = np.asarray(groups)
+    if len(groups) == 0:
+        return np.zeros(0, dtype=int)
+    boxes = np.asarray(boxes)
+    scores = None if scores is None else np.asarray(scores)
+    order = np.argsort(groups, kind='stable')
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+    pick = []
+    for indices in np.split(order, bounds):
+        keep = non_max_suppression(
+            boxes[indices], max_bbox_overlap,
+            None if scores is None else scores[indices])
+        pick.append(indices[keep])
+    return np.sort(np.concatenate(pick))
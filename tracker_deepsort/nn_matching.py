@@ -83,10 +83,24 @@ def _nn_cosine_distance(x, y):
     return distances.min(axis=0)
 
 
+_STORAGE_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int8": np.int8,
+}
+
+
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
+    Samples live in one preallocated pool of shape (samples,
+    dimensionality). Every target owns a block of the pool that it uses as
+    a ring buffer of `budget` samples. Without a budget a full block is
+    moved to a block of twice the size, so a long-lived target only grows
+    its own block. Freed blocks are reused by targets of the same block
+    size, and the pool is compacted once free blocks make up half of it.
+    For the cosine metric samples are normalized once on insertion.
     Parameters
     ----------
     metric : str
@@ -96,27 +110,137 @@ class NearestNeighborDistanceMetric(object):
         invalid match.
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
-        the oldest samples when the budget is reached.
+        the oldest samples when the budget is reached. If None, the samples
+        of every target are kept without bound.
+    storage : Optional[str]
+        Element type of the pool. One of "float32" (default), "float16" or
+        "int8". With "int8" every sample is quantized symmetrically with its
+        own scale factor. The compact types trade a small amount of distance
+        precision for 2x (float16) or almost 4x (int8) less gallery memory
+        and matrix product bandwidth.
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the samples that
+        have been observed so far, oldest first. Read-only view of the pool.
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None,
+                 storage="float32"):
 
 
-        if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
-        elif metric == "cosine":
-            self._metric = _nn_cosine_distance
-        else:
+        if metric not in ("euclidean", "cosine"):
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        if storage not in _STORAGE_DTYPES:
+            raise ValueError(
+                "Invalid storage; must be either 'float32', 'float16' or "
+                "'int8'")
+        self.metric = metric
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.storage = storage
+
+        self._rows = {}  # target -> row of the block tables below
+        self._free_rows = []
+        self._offset = np.zeros(0, dtype=np.int64)
+        self._capacity = np.zeros(0, dtype=np.int64)
+        self._count = np.zeros(0, dtype=np.int64)
+        self._head = np.zeros(0, dtype=np.int64)
+        self._gallery = None
+        self._scales = None
+        self._sq_norms = None
+        self._pool_used = 0  # pool slots handed out, free blocks included
+        self._reserved = 0  # pool slots in blocks of live targets
+        self._free_blocks = {}  # block capacity -> offsets of free blocks
+
+    @property
+    def samples(self):
+        samples = {}
+        for target, row in self._rows.items():
+            offset, capacity = self._offset[row], self._capacity[row]
+            count, head = self._count[row], self._head[row]
+            ring = self._gallery[offset:offset + count].astype(np.float32)
+            if self._scales is not None:
+                ring *= self._scales[offset:offset + count, np.newaxis]
+            if count == capacity:
+                ring = np.roll(ring, -head, axis=0)
+            samples[target] = ring
+        return samples
+
+    def memory_usage(self):
+        """Report the memory held by the sample gallery.
+        Returns
+        -------
+        Dict[str -> int]
+            The number of `targets`, the number of stored `samples`, the
+            allocated pool and block table size in `bytes` and the
+            allocated `bytes_per_target`.
+        """
+        arrays = (self._gallery, self._scales, self._sq_norms, self._offset,
+                  self._capacity, self._count, self._head)
+        nbytes = sum(a.nbytes for a in arrays if a is not None)
+        targets = len(self._rows)
+        return {
+            "targets": targets,
+            "samples": int(self._count.sum()),
+            "bytes": nbytes,
+            "bytes_per_target": nbytes // targets if targets else 0,
+        }
+
+    def get_state(self):
+        """Returns the sample gallery as a flat dict of arrays, see
+        `set_state`. Only the samples of live targets are stored, oldest
+        first and concatenated in the order of `targets`.
+        """
+        rows = np.fromiter(self._rows.values(), dtype=np.int64,
+                           count=len(self._rows))
+        state = {
+            'targets': np.fromiter(self._rows.keys(), dtype=np.int64,
+                                   count=len(self._rows)),
+            'count': self._count[rows],
+        }
+        if self._gallery is not None:
+            samples = self._ordered_samples(rows)
+            state['gallery'] = self._gallery[samples]
+            state['sq_norms'] = self._sq_norms[samples]
+            if self._scales is not None:
+                state['scales'] = self._scales[samples]
+        return state
+
+    def set_state(self, state):
+        """Replace the sample gallery with the output of `get_state` of a
+        metric with the same metric type, budget and storage. The pool is
+        rebuilt for the stored targets only.
+        """
+        gallery = state.get('gallery')
+        if gallery is not None and \
+                gallery.dtype != _STORAGE_DTYPES[self.storage]:
+            raise ValueError(
+                "Gallery storage mismatch; state holds %s, metric uses %s" %
+                (gallery.dtype, self.storage))
+        self._rows = {}
+        self._free_rows = []
+        for name in ('offset', 'capacity', 'count', 'head'):
+            setattr(self, '_' + name, np.zeros(0, dtype=np.int64))
+        self._gallery = self._scales = self._sq_norms = None
+        self._pool_used = self._reserved = 0
+        self._free_blocks = {}
+        if gallery is None:
+            return
+        counts = np.asarray(state['count'], dtype=np.int64)
+        capacities = [self._block_capacity(count) for count in counts.tolist()]
+        self._allocate(gallery.shape[1], sum(capacities))
+        rows = np.array([
+            self._acquire(target, capacity) for target, capacity in
+            zip(state['targets'].tolist(), capacities)], dtype=np.int64)
+        self._count[rows] = counts
+        self._head[rows] = counts % self._capacity[rows]
+        samples = self._ordered_samples(rows)
+        self._gallery[samples] = gallery
+        self._sq_norms[samples] = state['sq_norms']
+        if self._scales is not None:
+            self._scales[samples] = state['scales']
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -129,13 +253,39 @@ class NearestNeighborDistanceMetric(object):
         active_targets : List[int]
             A list of targets that are currently present in the scene.
         """
-        for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+        if len(features) > 0:
+            self._insert(np.asarray(features, dtype=np.float32), targets)
+        active_targets = set(active_targets)
+        released = [t for t in self._rows if t not in active_targets]
+        for target in released:
+            self._release(target)
+        # Give memory back after a crowd has left.
+        if released and self._gallery is not None and \
+                len(self._sq_norms) > max(4 * self._reserved,
+                                          self._min_pool_length()):
+            self._compact(self._reserved)
+
+    def normalize(self, features):
+        """Prepare query features for `distance`. For the cosine metric rows
+        are scaled to unit length, so that callers that query the same
+        features several times (e.g. once per matching cascade level) only
+        normalize them once.
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        Returns
+        -------
+        ndarray
+            The prepared float32 features.
+        """
+        features = np.asarray(features, dtype=np.float32)
+        if self.metric == "cosine" and len(features) > 0:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
+        return features
 
-    def distance(self, features, targets):
+    def distance(self, features, targets, data_is_normalized=False):
         """Compute distance between features and targets.
         Parameters
         ----------
@@ -143,6 +293,8 @@ class NearestNeighborDistanceMetric(object):
             An NxM matrix of N features of dimensionality M.
         targets : List[int]
             A list of targets to match the given `features` against.
+        data_is_normalized : Optional[bool]
+            If True, assumes `features` have been prepared with `normalize`.
         Returns
         -------
         ndarray
@@ -150,7 +302,221 @@ class NearestNeighborDistanceMetric(object):
             element (i, j) contains the closest squared distance between
             `targets[i]` and `features[j]`.
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
\ No newline at end of file
+        cost_matrix = np.full((len(targets), len(features)), np.inf)
+        if len(targets) == 0 or len(features) == 0:
+            return cost_matrix
+        if not data_is_normalized:
+            features = self.normalize(features)
+
+        # Concatenate the stored samples of all targets into one matrix with
+        # a segment per target; written ring slots are always the first
+        # count slots of a block.
+        rows = np.array([self._rows[target] for target in targets])
+        counts = self._count[rows]
+        nonempty = counts > 0
+        rows, counts = rows[nonempty], counts[nonempty]
+        if len(rows) == 0:
+            return cost_matrix
+        segments = np.cumsum(counts) - counts
+        samples = np.repeat(self._offset[rows] - segments, counts) + \
+            np.arange(counts.sum())
+
+        # One matrix product against all samples, reduced per segment.
+        gallery = self._gallery[samples]
+        products = np.dot(gallery.astype(np.float32, copy=False), features.T)
+        if self._scales is not None:
+            products *= self._scales[samples][:, np.newaxis]
+        if self.metric == "cosine":
+            distances = 1. - products
+        else:
+            distances = -2. * products
+            distances += self._sq_norms[samples][:, np.newaxis]
+            distances += np.square(features).sum(axis=1)[np.newaxis, :]
+            np.maximum(distances, 0., out=distances)
+        cost_matrix[nonempty] = np.minimum.reduceat(
+            distances, segments, axis=0)
+        return cost_matrix
+
+    def _insert(self, features, targets):
+        if self._gallery is None:
+            self._allocate(features.shape[1])
+        features = self.normalize(features)
+        if self._scales is not None:
+            # Symmetric per-sample quantization; squared norms are taken from
+            # the dequantized values to keep euclidean distances consistent.
+            scales = np.abs(features).max(axis=1) / 127.
+            scales[scales == 0] = 1.
+            features = np.rint(features / scales[:, np.newaxis])
+            sq_norms = np.square(features).sum(axis=1) * np.square(scales)
+        else:
+            features = features.astype(self._gallery.dtype, copy=False)
+            sq_norms = np.square(features, dtype=np.float32).sum(axis=1)
+        rows = np.array([
+            self._rows[target] if target in self._rows
+            else self._acquire(int(target)) for target in targets])
+
+        # Samples of the same target have to be written one after another;
+        # rank them by occurrence and write one rank at a time. Usually every
+        # target receives a single sample per frame.
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        first = np.r_[True, sorted_rows[1:] != sorted_rows[:-1]]
+        group_start = np.maximum.accumulate(
+            np.where(first, np.arange(len(rows)), 0))
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[order] = np.arange(len(rows)) - group_start
+
+        for r in range(rank.max() + 1):
+            selected = rank == r
+            rows_r = rows[selected]
+            if self.budget is None:
+                full = self._count[rows_r] == self._capacity[rows_r]
+                for row in rows_r[full].tolist():
+                    self._grow_block(row)
+            capacity = self._capacity[rows_r]
+            head = self._head[rows_r]
+            slots = self._offset[rows_r] + head
+            self._gallery[slots] = features[selected]
+            self._sq_norms[slots] = sq_norms[selected]
+            if self._scales is not None:
+                self._scales[slots] = scales[selected]
+            self._head[rows_r] = (head + 1) % capacity
+            self._count[rows_r] = np.minimum(self._count[rows_r] + 1, capacity)
+
+    def _block_capacity(self, count=0):
+        # Budgeted blocks hold `budget` samples; unbounded ones start at 16
+        # samples and double.
+        if self.budget is not None:
+            return self.budget
+        capacity = 16
+        while capacity < count:
+            capacity *= 2
+        return capacity
+
+    def _min_pool_length(self):
+        return 16 * self._block_capacity()
+
+    def _allocate(self, ndim, length=0):
+        length = max(length, self._min_pool_length())
+        self._gallery = np.zeros(
+            (length, ndim), dtype=_STORAGE_DTYPES[self.storage])
+        self._sq_norms = np.zeros(length, dtype=np.float32)
+        if self.storage == "int8":
+            self._scales = np.zeros(length, dtype=np.float32)
+
+    def _acquire(self, target, capacity=None):
+        if not self._free_rows:
+            self._grow_targets()
+        row = self._free_rows.pop()
+        if capacity is None:
+            capacity = self._block_capacity()
+        self._offset[row] = self._allocate_block(capacity)
+        self._capacity[row] = capacity
+        self._count[row] = 0
+        self._head[row] = 0
+        self._rows[target] = row
+        return row
+
+    def _release(self, target):
+        row = self._rows.pop(target)
+        self._free_block(self._offset[row], self._capacity[row])
+        self._count[row] = 0
+        self._head[row] = 0
+        self._free_rows.append(row)
+
+    def _grow_block(self, row):
+        # Only used without budget: rings are never wrapped around, hence the
+        # samples of a full block are already stored oldest first.
+        capacity = int(self._capacity[row])
+        offset = self._allocate_block(2 * capacity)
+        # Allocating may have compacted the pool and moved the old block.
+        old = self._offset[row]
+        self._gallery[offset:offset + capacity] = \
+            self._gallery[old:old + capacity]
+        self._sq_norms[offset:offset + capacity] = \
+            self._sq_norms[old:old + capacity]
+        if self._scales is not None:
+            self._scales[offset:offset + capacity] = \
+                self._scales[old:old + capacity]
+        self._free_block(old, capacity)
+        self._offset[row] = offset
+        self._capacity[row] = 2 * capacity
+        self._head[row] = capacity
+
+    def _allocate_block(self, capacity):
+        free = self._free_blocks.get(capacity)
+        if free:
+            offset = free.pop()
+        else:
+            if self._pool_used + capacity > len(self._sq_norms):
+                self._reserve(capacity)
+            offset = self._pool_used
+            self._pool_used += capacity
+        self._reserved += capacity
+        return offset
+
+    def _free_block(self, offset, capacity):
+        self._free_blocks.setdefault(int(capacity), []).append(int(offset))
+        self._reserved -= int(capacity)
+
+    def _reserve(self, capacity):
+        # Make room for a new block of `capacity` samples at the end of the
+        # pool, compacting it first if half of it is free blocks.
+        if 2 * (self._pool_used - self._reserved) >= self._pool_used:
+            self._compact(self._reserved + capacity)
+        needed = self._pool_used + capacity
+        if needed > len(self._sq_norms):
+            self._resize_pool(max(2 * len(self._sq_norms), needed))
+
+    def _compact(self, length):
+        # Move the blocks of live targets to the front of a new pool with
+        # room for twice `length` samples and forget the free blocks.
+        rows = np.fromiter(self._rows.values(), dtype=np.int64,
+                           count=len(self._rows))
+        capacities = self._capacity[rows]
+        offsets = np.cumsum(capacities) - capacities
+        within = np.arange(capacities.sum()) - np.repeat(offsets, capacities)
+        source = np.repeat(self._offset[rows], capacities) + within
+        length = max(2 * length, self._min_pool_length())
+        for name in ('gallery', 'sq_norms', 'scales'):
+            array = getattr(self, '_' + name)
+            if array is not None:
+                pool = np.zeros((length,) + array.shape[1:], dtype=array.dtype)
+                pool[:len(source)] = array[source]
+                setattr(self, '_' + name, pool)
+        self._offset[rows] = offsets
+        self._pool_used = int(capacities.sum())
+        self._free_blocks = {}
+
+    def _resize_pool(self, length):
+        self._gallery = _resize(self._gallery, length, axis=0)
+        self._sq_norms = _resize(self._sq_norms, length, axis=0)
+        if self._scales is not None:
+            self._scales = _resize(self._scales, length, axis=0)
+
+    def _ordered_samples(self, rows):
+        # Pool indices of the samples of `rows`, oldest first.
+        counts = self._count[rows]
+        capacities = np.repeat(self._capacity[rows], counts)
+        starts = (self._head[rows] - counts) % self._capacity[rows]
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        within = np.arange(counts.sum()) - offsets + np.repeat(starts, counts)
+        return np.repeat(self._offset[rows], counts) + within % capacities
+
+    def _grow_targets(self):
+        old_rows = len(self._offset)
+        new_rows = max(2 * old_rows, 16)
+        for name in ('offset', 'capacity', 'count', 'head'):
+            setattr(self, '_' + name,
+                    _resize(getattr(self, '_' + name), new_rows, axis=0))
+        self._free_rows.extend(range(new_rows - 1, old_rows - 1, -1))
+
+
+def _resize(array, length, axis):
+    shape = list(array.shape)
+    shape[axis] = length
+    result = np.zeros(shape, dtype=array.dtype)
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(0, array.shape[axis])
+    result[tuple(index)] = array
+    return result
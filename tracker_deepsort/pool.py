@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+
+import time
+from collections import OrderedDict
+
+from .deepsort import DeepSort
+
+
+class TrackerPool(object):
+    """
+    Keeps one independent tracker per video stream. Trackers are created
+    lazily on the first frame of a stream and dropped once the stream has
+    been idle for `max_idle` seconds, so track state and appearance galleries
+    of different cameras never mix and do not outlive their stream.
+    Parameters
+    ----------
+    max_idle : Optional[float]
+        Number of seconds without frames after which a stream's tracker is
+        evicted. If None, trackers are never evicted.
+    factory : Callable[] -> DeepSort
+        Creates the tracker of a new stream. Defaults to `DeepSort` with the
+        keyword arguments in `tracker_kwargs`.
+    clock : Callable[] -> float
+        Time source used for idle eviction.
+    Attributes
+    ----------
+    trackers : OrderedDict[str -> DeepSort]
+        The trackers of all known streams, least recently used first.
+    """
+
+    def __init__(self, max_idle=300., factory=None, clock=time.monotonic,
+                 **tracker_kwargs):
+        if factory is None:
+            def factory():
+                return DeepSort(**tracker_kwargs)
+        self.max_idle = max_idle
+        self.factory = factory
+        self.clock = clock
+        self.trackers = OrderedDict()
+        self._last_seen = {}
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def __contains__(self, key):
+        return key in self.trackers
+
+    def get(self, key):
+        """Returns the tracker of stream `key`, creating it if necessary, and
+        marks the stream as active.
+        """
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            tracker = self.trackers[key] = self.factory()
+        else:
+            self.trackers.move_to_end(key)
+        self._last_seen[key] = self.clock()
+        return tracker
+
+    def evict(self, key):
+        """Drop the tracker of stream `key`, if present."""
+        self._last_seen.pop(key, None)
+        return self.trackers.pop(key, None)
+
+    def idle(self):
+        """Returns the keys of the streams that have been idle for longer
+        than `max_idle` seconds, without evicting them.
+        """
+        if self.max_idle is None:
+            return []
+        deadline = self.clock() - self.max_idle
+        idle = []
+        # Trackers are kept in order of use, the idle ones come first.
+        for key in self.trackers:
+            if self._last_seen[key] > deadline:
+                break
+            idle.append(key)
+        return idle
+
+    def evict_idle(self):
+        """Drop all trackers whose stream has been idle for longer than
+        `max_idle` seconds.
+        Returns
+        -------
+        List[str]
+            The keys of the evicted streams.
+        """
+        evicted = self.idle()
+        for key in evicted:
+            self.evict(key)
+        return evicted
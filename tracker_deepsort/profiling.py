@@ -0,0 +1,140 @@
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler(object):
+    """
+    Profiler that records nothing. Used by the tracker when profiling is
+    disabled; every hook returns immediately.
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, value):
+        pass
+
+    def end_frame(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage(object):
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        frame = self._profiler._frame
+        frame[self._name] = frame.get(self._name, 0.) + \
+            time.perf_counter() - self._start
+        return False
+
+
+class StageProfiler(object):
+    """
+    Records the wall time of tracker stages and per-frame counters.
+    Stage times are accumulated over a frame (a stage may run several times,
+    e.g. once per cascade level) and pushed into a window of the most recent
+    frames when `end_frame` is called.
+    Parameters
+    ----------
+    window : int
+        Number of most recent frames kept per stage and counter.
+    Attributes
+    ----------
+    frames : int
+        Total number of recorded frames.
+    """
+
+    enabled = True
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.frames = 0
+        self._frame = {}
+        self._counts = {}
+        self._counters = set()
+        self._history = {}
+
+    def stage(self, name):
+        """Returns a context manager that times the enclosed block as `name`.
+        """
+        return _Stage(self, name)
+
+    def count(self, name, value):
+        """Record a per-frame counter, e.g. the number of tracks."""
+        self._counts[name] = value
+
+    def end_frame(self):
+        """Close the current frame and add its stage times (in seconds) and
+        counters to the history.
+        """
+        for name, value in self._frame.items():
+            self._series(name).append(value)
+        for name, value in self._counts.items():
+            self._counters.add(name)
+            self._series(name).append(value)
+        self._frame = {}
+        self._counts = {}
+        self.frames += 1
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """Summarize the recorded window.
+        Parameters
+        ----------
+        percentiles : Tuple[int]
+            The percentiles to report.
+        Returns
+        -------
+        Dict[str -> Dict[str -> float]]
+            Maps every stage and counter name to its `p50`, `p95`, `p99`
+            (or the requested percentiles), `mean` and number of samples `n`.
+            Stage times are reported in milliseconds.
+        """
+        summary = {}
+        for name, series in self._history.items():
+            values = np.asarray(series, dtype=float)
+            if name not in self._counters:
+                values = values * 1e3
+            stats = dict(zip(
+                ('p%d' % p for p in percentiles),
+                np.percentile(values, percentiles)))
+            stats['mean'] = float(values.mean())
+            stats['n'] = len(values)
+            summary[name] = stats
+        return summary
+
+    def reset(self):
+        """Drop all recorded frames."""
+        self.__init__(self.window)
+
+    def _series(self, name):
+        series = self._history.get(name)
+        if series is None:
+            series = self._history[name] = deque(maxlen=self.window)
+        return series
@@ -1,5 +1,4 @@
 
-from ..dev_kafka_producer import connect_kafka_producer, publish_message, json
 from .ndencoder import NumpyArrayEncoder
 
 
@@ -18,35 +17,42 @@ class TrackState:
     Closed = 4
 
 
+def _column(name, convert):
+    """Create a property that maps a track attribute onto the `name` column of
+    the track table, optionally converting numpy scalars with `convert`.
+    """
+    def fget(self):
+        value = getattr(self._table, name)[self.slot]
+        return value if convert is None else convert(value)
+
+    def fset(self, value):
+        getattr(self._table, name)[self.slot] = value
+
+    return property(fget, fset)
+
+
 class Track:
     """
     A single target track with state space `(x, y, a, h)` and associated
     velocities, where `(x, y)` is the center of the bounding box, `a` is the
     aspect ratio and `h` is the height.
+    A track is a lightweight view onto one slot of a `TrackTable`; all
+    attributes read and write the table columns of that slot. New tracks are
+    created with `TrackTable.add`.
     Parameters
     ----------
-    mean : ndarray
-        Mean vector of the initial state distribution.
-    covariance : ndarray
-        Covariance matrix of the initial state distribution.
-    track_id : int
-        A unique track identifier.
-    n_init : int
-        Number of consecutive detections before the track is confirmed. The
-        track state is set to `Deleted` if a miss occurs within the first
-        `n_init` frames.
-    max_age : int
-        The maximum number of consecutive misses before the track state is
-        set to `Deleted`.
-    feature : Optional[ndarray]
-        Feature vector of the detection this track originates from. If not None,
-        this feature is added to the `features` cache.
+    table : track_table.TrackTable
+        The table that stores the track.
+    slot : int
+        Index of the row that holds this track in the table.
     Attributes
     ----------
     mean : ndarray
-        Mean vector of the initial state distribution.
+        Mean vector of the current state distribution.
     covariance : ndarray
-        Covariance matrix of the initial state distribution.
+        Covariance matrix of the current state distribution.
+    slot : int
+        Index of the row that holds this track in the track table.
     track_id : int
         A unique track identifier.
     hits : int
@@ -66,22 +72,22 @@ class Track:
         Last frame time in unixtime
     """
 
-    def __init__(self, mean, covariance, start_ts, track_id, n_init, max_age,
-                 feature=None):
-        self.mean = mean
-        self.covariance = covariance
-        self.track_id = track_id
-        self.hits = 1
-        self.age = 1
-        self.time_since_update = 0
-        self.start_ts = start_ts
-        self.last_ts = start_ts
-        self.state = TrackState.Tentative
-        self.features = []
-        if feature is not None:
-            self.features.append(feature)
-        self._n_init = n_init
-        self._max_age = max_age
+    __slots__ = ('_table', 'slot')
+
+    def __init__(self, table, slot):
+        self._table = table
+        self.slot = slot
+
+    mean = _column('mean', None)
+    covariance = _column('covariance', None)
+    track_id = _column('track_id', int)
+    hits = _column('hits', int)
+    age = _column('age', int)
+    time_since_update = _column('time_since_update', int)
+    state = _column('state', int)
+    start_ts = _column('start_ts', int)
+    last_ts = _column('last_ts', int)
+    features = _column('features', None)
 
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
@@ -132,11 +138,22 @@ class Track:
         """
         self.mean, self.covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
+        self.mark_hit(detection)
+
+    def mark_hit(self, detection):
+        """Register a measurement update whose Kalman filter correction has
+        already been applied to this track's state, e.g. by a batched update.
+        Parameters
+        ----------
+        detection : Detection
+            The associated detection.
+        """
         self.features.append(detection.feature)
         self.last_ts = detection.ts
         self.hits += 1
         self.time_since_update = 0
-        if self.state == TrackState.Tentative and self.hits >= self._n_init:
+        if self.state == TrackState.Tentative and \
+                self.hits >= self._table.n_init:
             self.state = TrackState.Confirmed
 
     def mark_missed(self):
@@ -144,7 +161,7 @@ class Track:
         """
         if self.state == TrackState.Tentative:
             self.state = TrackState.Deleted
-        elif self.time_since_update > self._max_age:
+        elif self.time_since_update > self._table.max_age:
             self.state = TrackState.Closed
 
     def is_tentative(self):
@@ -0,0 +1,187 @@
+import numpy as np
+from .track import Track, TrackState
+
+
+_COLUMNS = ('mean', 'covariance', 'alive', 'state', 'track_id', 'hits', 'age',
+            'time_since_update', 'start_ts', 'last_ts')
+
+class TrackTable(object):
+    """
+    Struct-of-arrays storage for all tracks of a tracker. Every track owns
+    one slot (row) of the column arrays below, so that Kalman filter
+    prediction and correction run as single batched calls and track
+    selection becomes a mask operation. Slots of removed tracks are put on a
+    free list and reused by new tracks; rows are never compacted, hence a
+    slot index stays valid for the whole life of its track.
+    Parameters
+    ----------
+    capacity : int
+        Number of slots to preallocate. The table grows on demand.
+    n_init : int
+        Number of consecutive detections before a track is confirmed.
+    max_age : int
+        The maximum number of consecutive misses before a track is closed.
+    ndim : int
+        Dimensionality of the state space.
+    Attributes
+    ----------
+    mean : ndarray
+        The capacity x ndim matrix of state means.
+    covariance : ndarray
+        The capacity x ndim x ndim stack of state covariances.
+    alive : ndarray
+        Boolean mask of the slots that are currently in use.
+    state : ndarray
+        The `TrackState` of every slot.
+    track_id : ndarray
+        Unique track identifier of every slot.
+    hits : ndarray
+        Total number of measurement updates.
+    age : ndarray
+        Total number of frames since first occurance.
+    time_since_update : ndarray
+        Total number of frames since last measurement update.
+    start_ts : ndarray
+        First frame time in unixtime.
+    last_ts : ndarray
+        Last frame time in unixtime.
+    features : List[List[ndarray]]
+        Per slot cache of features that have not been handed to the distance
+        metric yet.
+    """
+
+    def __init__(self, capacity=32, n_init=3, max_age=30, ndim=8):
+        capacity = max(int(capacity), 1)
+        self.n_init = n_init
+        self.max_age = max_age
+        self.mean = np.zeros((capacity, ndim))
+        self.covariance = np.zeros((capacity, ndim, ndim))
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.track_id = np.zeros(capacity, dtype=np.int64)
+        self.hits = np.zeros(capacity, dtype=np.int32)
+        self.age = np.zeros(capacity, dtype=np.int32)
+        self.time_since_update = np.zeros(capacity, dtype=np.int32)
+        self.start_ts = np.zeros(capacity, dtype=np.int64)
+        self.last_ts = np.zeros(capacity, dtype=np.int64)
+        self.features = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def __getitem__(self, slot):
+        return Track(self, slot)
+
+    def __iter__(self):
+        return (Track(self, slot) for slot in self.live_slots())
+
+    @property
+    def capacity(self):
+        return len(self.alive)
+
+    def add(self, mean, covariance, ts, track_id, feature=None):
+        """Insert a new tentative track.
+        Parameters
+        ----------
+        mean : ndarray
+            Mean vector of the initial state distribution.
+        covariance : ndarray
+            Covariance matrix of the initial state distribution.
+        ts : int
+            Unix timestamp of the frame the track originates from.
+        track_id : int
+            A unique track identifier.
+        feature : Optional[ndarray]
+            Feature vector of the detection this track originates from.
+        Returns
+        -------
+        int
+            The slot of the new track.
+        """
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.alive[slot] = True
+        self.mean[slot] = mean
+        self.covariance[slot] = covariance
+        self.state[slot] = TrackState.Tentative
+        self.track_id[slot] = track_id
+        self.hits[slot] = 1
+        self.age[slot] = 1
+        self.time_since_update[slot] = 0
+        self.start_ts[slot] = ts
+        self.last_ts[slot] = ts
+        self.features[slot] = [] if feature is None else [feature]
+        return slot
+
+    def release(self, slots):
+        """Remove the tracks in `slots` and put their slots on the free list.
+        """
+        slots = np.atleast_1d(slots)
+        slots = slots[self.alive[slots]]
+        self.alive[slots] = False
+        for slot in slots.tolist():
+            self.features[slot] = None
+            self._free.append(slot)
+
+    def live_slots(self):
+        """Returns the indices of all slots in use, in ascending order."""
+        return np.flatnonzero(self.alive)
+
+    def to_tlwh(self, slots):
+        """Get the current positions of the tracks in `slots` in bounding box
+        format `(top left x, top left y, width, height)`.
+        Returns
+        -------
+        ndarray
+            A len(slots) x 4 matrix of bounding boxes.
+        """
+        ret = self.mean[slots, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def get_state(self):
+        """Returns the contents of the live slots as a flat dict of arrays,
+        see `set_state`. Pending features are stored as one matrix together
+        with the position of the track every row belongs to.
+        """
+        slots = self.live_slots()
+        state = {name: getattr(self, name)[slots] for name in _COLUMNS}
+        positions = [i for i, slot in enumerate(slots.tolist())
+                     for _ in self.features[slot]]
+        features = [f for slot in slots.tolist() for f in self.features[slot]]
+        state['feature_slots'] = np.asarray(positions, dtype=np.int64)
+        state['features'] = np.asarray(features, dtype=np.float32)
+        return state
+
+    def set_state(self, state):
+        """Replace the table contents with the output of `get_state`. The
+        tracks are placed in the first slots of a table of the default
+        capacity or just large enough to hold them.
+        """
+        count = len(state['alive'])
+        capacity = max(count, 32)
+        for name in _COLUMNS:
+            setattr(self, name, _resize(np.asarray(state[name]), capacity))
+        self.features = [[] for _ in range(count)] + \
+            [None] * (capacity - count)
+        for slot, feature in zip(state['feature_slots'].tolist(),
+                                 np.array(state['features'])):
+            self.features[slot].append(feature)
+        self._free = list(range(capacity - 1, count - 1, -1))
+
+    def _grow(self):
+        old_capacity = self.capacity
+        new_capacity = 2 * old_capacity
+        for name in _COLUMNS:
+            setattr(self, name, _resize(getattr(self, name), new_capacity))
+        self.features.extend([None] * (new_capacity - old_capacity))
+        self._free.extend(range(new_capacity - 1, old_capacity - 1, -1))
+
+
+def _resize(array, length):
+    result = np.zeros((length,) + array.shape[1:], dtype=array.dtype)
+    result[:len(array)] = array
+    return result
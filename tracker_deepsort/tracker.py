@@ -1,9 +1,13 @@
 from __future__ import absolute_import
+import io
 import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .detection import DetectionBatch
+from .profiling import NULL_PROFILER
+from .track import TrackState
+from .track_table import TrackTable
 
 
 class Tracker:
@@ -19,6 +23,12 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    assignment_solver : str | Callable
+        Backend that solves the linear assignment problems, see
+        `linear_assignment.get_assignment_solver`.
+    profiler : Optional[profiling.StageProfiler]
+        If given, per-frame stage timings and track/detection/match counts
+        are recorded into this profiler.
     Attributes
     ----------
     metric : nn_matching.NearestNeighborDistanceMetric
@@ -27,118 +37,222 @@ class Tracker:
         Maximum number of missed misses before a track is deleted.
     n_init : int
         Number of frames that a track remains in initialization phase.
+    assignment_solver : Callable[ndarray, float] -> (ndarray, ndarray)
+        The assignment solver backend.
+    profiler : profiling.StageProfiler | profiling.NullProfiler
+        The stage profiler; a no-op profiler if profiling is disabled.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    table : track_table.TrackTable
+        Column store of all tracks. Track indices used throughout the matching
+        code (and returned by `update`) are slots of this table.
     tracks : List[Track]
-        The list of active tracks at the current time step.
+        The list of active tracks at the current time step, as views onto the
+        track table.
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3,
+                 assignment_solver="components", profiler=None):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.assignment_solver = linear_assignment.get_assignment_solver(
+            assignment_solver)
+        self.profiler = NULL_PROFILER if profiler is None else profiler
 
         self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        self.table = TrackTable(n_init=n_init, max_age=max_age)
         self._next_id = 1
         # self._all_tracks = [] # Debug
 
+    @property
+    def tracks(self):
+        return list(self.table)
+
+    def snapshot(self):
+        """Serialize the tracker state: the track table (including Kalman
+        filter states and pending features), the appearance gallery of the
+        metric and the next track id.
+        Returns
+        -------
+        bytes
+            An uncompressed npz archive, see `restore`.
+        """
+        state = {'next_id': np.int64(self._next_id)}
+        state.update(('table/' + name, value)
+                     for name, value in self.table.get_state().items())
+        state.update(('metric/' + name, value)
+                     for name, value in self.metric.get_state().items())
+        buffer = io.BytesIO()
+        np.savez(buffer, **state)
+        return buffer.getvalue()
+
+    def restore(self, snapshot):
+        """Replace the tracker state with a `snapshot`. The tracker has to be
+        configured like the one that took the snapshot.
+        """
+        with np.load(io.BytesIO(snapshot)) as archive:
+            state = dict(archive.items())
+        parts = {'table': {}, 'metric': {}}
+        for key, value in state.items():
+            if '/' in key:
+                part, name = key.split('/', 1)
+                parts[part][name] = value
+        self.table.set_state(parts['table'])
+        self.metric.set_state(parts['metric'])
+        self._next_id = int(state['next_id'])
+
     def predict(self):
         """Propagate track state distributions one time step forward.
         This function should be called once every time step, before `update`.
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        table = self.table
+        slots = table.live_slots()
+        if len(slots) == 0:
+            return
+        with self.profiler.stage('predict'):
+            table.mean[slots], table.covariance[slots] = \
+                self.kf.multi_predict(
+                    table.mean[slots], table.covariance[slots])
+            table.age[slots] += 1
+            table.time_since_update[slots] += 1
 
     def update(self, detections):
         """Perform measurement update and track management.
         Parameters
         ----------
-        - detections : List[deep_sort.detection.Detection]
-            A list of detections at the current time step.
+        - detections : detection.DetectionBatch | List[detection.Detection]
+            The detections at the current time step.
 
         Returns
         -------
-        - matches: List[(int, int)] matche from track_id to det_id
-        - unmatched_tracks: List[int]
+        - matches: List[(int, int)] matche from track slot to det_id
+        - unmatched_tracks: List[int] track slots
         - unmatched_detections: List[int]
         """
+        table = self.table
+        profiler = self.profiler
+        if not isinstance(detections, DetectionBatch):
+            detections = DetectionBatch.from_detections(detections)
+        # Detections in measurement space and query features for the
+        # distance metric, computed once per frame.
+        measurements = detections.to_xyah()
+        query_features = self.metric.normalize(detections.feature)
+
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(detections, measurements, query_features)
 
         # Update track set.
-        for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-                self.kf, detections[detection_idx])
-        for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
+        if len(matches) > 0:
+            slots, detection_indices = map(np.asarray, zip(*matches))
+            with profiler.stage('kalman_update'):
+                table.mean[slots], table.covariance[slots] = \
+                    self.kf.multi_update(
+                        table.mean[slots], table.covariance[slots],
+                        measurements[detection_indices])
+            table.last_ts[slots] = detections.ts[detection_indices]
+            table.hits[slots] += 1
+            table.time_since_update[slots] = 0
+            confirm = (table.state[slots] == TrackState.Tentative) & \
+                (table.hits[slots] >= self.n_init)
+            table.state[slots[confirm]] = TrackState.Confirmed
+            # Copy the matched features, the caller may reuse its buffers.
+            features = detections.feature[detection_indices]
+            for slot, feature in zip(slots.tolist(), features):
+                table.features[slot].append(feature)
+        if len(unmatched_tracks) > 0:
+            slots = np.asarray(unmatched_tracks)
+            tentative = table.state[slots] == TrackState.Tentative
+            expired = ~tentative & (
+                table.time_since_update[slots] > self.max_age)
+            table.state[slots[tentative]] = TrackState.Deleted
+            table.state[slots[expired]] = TrackState.Closed
         for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx])
-        
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+            self._initiate_track(
+                measurements[detection_idx], detections.ts[detection_idx],
+                detections.feature[detection_idx].copy())
+
+        alive = table.live_slots()
+        state = table.state[alive]
+        table.release(alive[(state == TrackState.Deleted) |
+                            (state == TrackState.Closed)])
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
+        confirmed = alive[state == TrackState.Confirmed]
+        active_targets = table.track_id[confirmed].tolist()
         features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = []
-        self.metric.partial_fit(
-            np.asarray(features), np.asarray(targets), active_targets)
+        for slot, track_id in zip(confirmed.tolist(), active_targets):
+            track_features = table.features[slot]
+            features += track_features
+            targets += [track_id] * len(track_features)
+            table.features[slot] = []
+        with profiler.stage('partial_fit'):
+            self.metric.partial_fit(
+                np.asarray(features), np.asarray(targets), active_targets)
+
+        if profiler.enabled:
+            profiler.count('detections', len(detections))
+            profiler.count('matches', len(matches))
+            profiler.count('tracks', len(table))
+        profiler.end_frame()
         return matches, unmatched_tracks, unmatched_detections
 
-    def _match(self, detections):
+    def _match(self, detections, measurements, features):
+        table = self.table
+        profiler = self.profiler
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
             '''
             - Returns:
                 - cost_matrix: np.array of shape (nb_confirmed_tracks, nb_detections)
             '''
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(
-                self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
+            targets = tracks.track_id[track_indices]
+            with profiler.stage('appearance'):
+                cost_matrix = self.metric.distance(
+                    features[detection_indices], targets,
+                    data_is_normalized=True)
+            with profiler.stage('gating'):
+                cost_matrix = linear_assignment.gate_cost_matrix(
+                    self.kf, cost_matrix, tracks, dets, track_indices,
+                    detection_indices,
+                    measurements=measurements[detection_indices])
 
             return cost_matrix
 
         # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        slots = table.live_slots()
+        is_confirmed = table.state[slots] == TrackState.Confirmed
+        confirmed_tracks = slots[is_confirmed]
+        unconfirmed_tracks = slots[~is_confirmed]
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                table, detections, confirmed_tracks,
+                solver=self.assignment_solver, profiler=profiler)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
-        iou_track_candidates = unconfirmed_tracks + [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
-        unmatched_tracks_a = [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
-        matches_b, unmatched_tracks_b, unmatched_detections = \
-            linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
-                detections, iou_track_candidates, unmatched_detections)
+        unmatched_tracks_a = np.asarray(unmatched_tracks_a, dtype=int)
+        recent = table.time_since_update[unmatched_tracks_a] == 1
+        iou_track_candidates = np.r_[
+            unconfirmed_tracks, unmatched_tracks_a[recent]]
+        unmatched_tracks_a = unmatched_tracks_a[~recent]
+        with profiler.stage('iou_matching'):
+            matches_b, unmatched_tracks_b, unmatched_detections = \
+                linear_assignment.min_cost_matching(
+                    iou_matching.iou_cost, self.max_iou_distance, table,
+                    detections, iou_track_candidates, unmatched_detections,
+                    solver=self.assignment_solver)
 
         matches = matches_a + matches_b
-        unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
+        unmatched_tracks = list(
+            set(unmatched_tracks_a.tolist()) | set(unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection):
-        mean, covariance = self.kf.initiate(detection.to_xyah())
-        self.tracks.append(Track(
-            mean, covariance, detection.ts, self._next_id,  self.n_init, self.max_age,
-            detection.feature))
+    def _initiate_track(self, measurement, ts, feature):
+        mean, covariance = self.kf.initiate(measurement)
+        self.table.add(mean, covariance, ts, self._next_id, feature)
         self._next_id += 1
@@ -0,0 +1,149 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+
+class IntervalIndex(object):
+    """
+    Closed intervals `[start, end]` of integer epoch seconds, kept sorted by
+    start. An overlap query bisects the start column for the intervals
+    starting in `[start - max_length, end]` and drops those that end too
+    early, so it costs O(log n + k) for k candidates instead of a scan over
+    every interval. Ends may grow after insertion, e.g. when a visit is
+    extended by later track updates.
+    The interval lengths are counted and kept in a max-heap, so
+    `max_length` drops back as soon as the longest interval is removed or
+    shortened and one long interval does not widen later queries.
+    Attributes
+    ----------
+    max_length : int
+        Largest `end - start` of the intervals in the index.
+    """
+    __slots__ = ('_starts', '_keys', '_items', '_lengths', '_length_heap',
+                 'max_length')
+
+    def __init__(self):
+        self._starts = []  # sorted interval starts
+        self._keys = []  # key of the interval at the same position
+        self._items = {}  # key -> [start, end, value]
+        self._lengths = Counter()  # length -> number of intervals
+        self._length_heap = []  # negated lengths, possibly of none left
+        self.max_length = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        return default if item is None else item[2]
+
+    def items(self):
+        """Iterate over `(key, start, end, value)` of all intervals."""
+        for key, (start, end, value) in self._items.items():
+            yield key, start, end, value
+
+    def add(self, key, start, end, value=None):
+        """Insert interval `key`, replacing an interval with the same key.
+        Parameters
+        ----------
+        key : hashable
+            Interval identifier, e.g. the track id of a visit.
+        start, end : int
+            Interval bounds in epoch seconds.
+        value : object
+            Payload returned by the queries.
+        """
+        if key in self._items:
+            self.remove(key)
+        start, end = int(start), int(end)
+        position = bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._keys.insert(position, key)
+        self._items[key] = [start, end, value]
+        self._add_length(end - start)
+
+    def update_end(self, key, end):
+        """Move the end of interval `key`. Returns False if there is no such
+        interval.
+        """
+        item = self._items.get(key)
+        if item is None:
+            return False
+        end = int(end)
+        if end != item[1]:
+            self._remove_length(item[1] - item[0])
+            item[1] = end
+            self._add_length(end - item[0])
+        return True
+
+    def remove(self, key):
+        """Remove interval `key` and return its value, None if absent."""
+        item = self._items.pop(key, None)
+        if item is None:
+            return None
+        position = bisect_left(self._starts, item[0])
+        while self._keys[position] != key:
+            position += 1
+        del self._starts[position]
+        del self._keys[position]
+        self._remove_length(item[1] - item[0])
+        return item[2]
+
+    def overlapping(self, start, end):
+        """Iterate over the intervals that intersect `[start, end]`.
+        Returns
+        -------
+        Iterator[(hashable, int, object)]
+            Key, overlap in seconds and value of every intersecting interval
+            in order of start. Intervals that only touch have overlap 0.
+        """
+        lo = bisect_left(self._starts, start - self.max_length)
+        hi = bisect_right(self._starts, end)
+        items = self._items
+        for key in self._keys[lo:hi]:
+            item_start, item_end, value = items[key]
+            if item_end >= start:
+                yield key, min(item_end, end) - max(item_start, start), value
+
+    def best_overlap(self, start, end):
+        """Find the interval with the largest overlap with `[start, end]`.
+        Ties go to the interval that starts first.
+        Returns
+        -------
+        Optional[(hashable, int, object)]
+            Key, overlap and value, None if no interval intersects.
+        """
+        best = None
+        for match in self.overlapping(start, end):
+            if best is None or match[1] > best[1]:
+                best = match
+        return best
+
+    def _add_length(self, length):
+        lengths = self._lengths
+        lengths[length] += 1
+        if lengths[length] == 1:
+            heap = self._length_heap
+            heapq.heappush(heap, -length)
+            # Lengths left without intervals below the top go stale; rebuild
+            # the heap before they outnumber the live ones.
+            if len(heap) > 2 * len(lengths) + 64:
+                heap[:] = [-n for n in lengths]
+                heapq.heapify(heap)
+        if length > self.max_length:
+            self.max_length = length
+
+    def _remove_length(self, length):
+        lengths = self._lengths
+        lengths[length] -= 1
+        if lengths[length]:
+            return
+        del lengths[length]
+        heap = self._length_heap
+        # Lengths without intervals are dropped once they reach the top.
+        while heap and -heap[0] not in lengths:
+            heapq.heappop(heap)
+        self.max_length = -heap[0] if heap else 0
@@ -0,0 +1,118 @@
+import heapq
+
+from .interval_index import IntervalIndex
+
+
+class PendingReceipts(object):
+    """
+    Receipts of one register that did not overlap any visit yet, waiting
+    for a late visit or for a track update that extends a visit over them.
+    Receipts are indexed by time range, so a changed visit is only checked
+    against the receipts it now overlaps, and ordered by event time (the
+    receipt's end) in a min-heap. The watermark trails the latest event
+    time seen on the register by `lateness` seconds; receipts that end
+    before it are given up.
+    Parameters
+    ----------
+    lateness : int
+        How long a receipt waits for its visit, in seconds of event time.
+    max_pending : int
+        Maximum number of waiting receipts, the oldest are given up first.
+    """
+
+    def __init__(self, lateness=300, max_pending=1000):
+        self.lateness = lateness
+        self.max_pending = max_pending
+        self.latest_ts = None
+        self.dropped = 0
+        self._index = IntervalIndex()
+        self._heap = []  # (end, guid), possibly of receipts already matched
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, guid):
+        return guid in self._index
+
+    @property
+    def watermark(self):
+        """Receipts that end before this epoch second are not kept."""
+        if self.latest_ts is None:
+            return None
+        return self.latest_ts - self.lateness
+
+    def add(self, guid, start, end):
+        """Keep a receipt until a visit overlaps it or the watermark passes
+        its end.
+        Returns
+        -------
+        List[str]
+            Guids of the receipts given up to make room, including `guid`
+            itself if it is already behind the watermark.
+        """
+        watermark = self.watermark
+        if watermark is not None and end < watermark:
+            self.dropped += 1
+            return [guid]
+        start, end = int(start), int(end)
+        self._index.add(guid, start, end, (start, end))
+        heapq.heappush(self._heap, (end, guid))
+        dropped = []
+        while len(self._index) > self.max_pending:
+            dropped += self._pop_oldest()
+        return dropped
+
+    def remove(self, guid):
+        """Forget a receipt, e.g. once it is matched."""
+        self._index.remove(guid)
+        # The heap entry goes stale; drop stale entries before they
+        # outnumber the waiting receipts.
+        if len(self._heap) > 2 * len(self._index) + 64:
+            self._heap = [(end, guid) for guid, _, end, _ in
+                          self._index.items()]
+            heapq.heapify(self._heap)
+
+    def overlapping(self, start, end):
+        """Waiting receipts that intersect `[start, end]`.
+        Returns
+        -------
+        List[(str, int, int)]
+            Guid, start and end of every receipt in order of event time.
+        """
+        return sorted(
+            ((guid,) + span for guid, _, span in
+             self._index.overlapping(start, end)),
+            key=lambda item: item[2])
+
+    def receipts(self):
+        """All waiting receipts as `(guid, start, end)` in order of event
+        time.
+        """
+        return sorted(((guid, start, end) for guid, start, end, _ in
+                       self._index.items()), key=lambda item: item[2])
+
+    def advance(self, ts):
+        """Move the latest event time to `ts` and give up the receipts that
+        fall behind the watermark.
+        Returns
+        -------
+        List[str]
+            Guids of the receipts given up.
+        """
+        if self.latest_ts is not None and ts <= self.latest_ts:
+            return []
+        self.latest_ts = int(ts)
+        watermark = self.watermark
+        dropped = []
+        while self._heap and self._heap[0][0] < watermark:
+            dropped += self._pop_oldest()
+        return dropped
+
+    def _pop_oldest(self):
+        end, guid = heapq.heappop(self._heap)
+        span = self._index.get(guid)
+        if span is None or span[1] != end:
+            return []
+        self._index.remove(guid)
+        self.dropped += 1
+        return [guid]
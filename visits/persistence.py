@@ -0,0 +1,130 @@
+import asyncio
+
+from pymongo import UpdateOne
+
+
+class WriteBehindWriter(object):
+    """
+    Write-behind buffer in front of a MongoDB collection. Updates are
+    coalesced per key in memory and written with one unordered `bulk_write`
+    of upserts per flush, so the agents never wait for a Mongo round trip
+    per event.
+    A flush starts in the background once `max_batch` keys are pending and
+    should also be triggered every few seconds by a timer. When `max_pending`
+    keys are pending, `put` waits for a flush to finish, which throttles the
+    consumer while Mongo is slow.
+    Parameters
+    ----------
+    collection : motor.motor_asyncio.AsyncIOMotorCollection
+        The target collection.
+    key_field : Union[str, Tuple[str, ...]]
+        Document field that identifies the document of a key. With a tuple
+        of fields, keys are tuples of their values.
+    max_batch : int
+        Number of pending keys that starts a background flush.
+    max_pending : int
+        Number of pending keys at which `put` blocks until a flush is done.
+    encode : Optional[Callable[[dict], dict]]
+        Applied to the coalesced fields of every key when they are written,
+        e.g. to turn epoch seconds into datetimes once per flush instead of
+        once per event.
+    max_retry_delay : float
+        Upper bound in seconds on the backoff between failed flushes while
+        `put` is blocked.
+    """
+
+    def __init__(self, collection, key_field='track_id', max_batch=500,
+                 max_pending=10000, encode=None, max_retry_delay=30.0):
+        self.collection = collection
+        self.key_field = key_field
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_pending = max(max_pending, max_batch)
+        self.max_retry_delay = max_retry_delay
+        self.pending = {}  # key -> fields to set
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+        self._lock = asyncio.Lock()
+        self._background = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def put(self, key, fields):
+        """Queue `fields` to be set on the document of `key`, creating it if
+        needed. Fields queued earlier for the same key are overwritten.
+        """
+        pending = self.pending.get(key)
+        if pending is None:
+            self.pending[key] = dict(fields)
+        else:
+            pending.update(fields)
+
+        if len(self.pending) >= self.max_pending:
+            await self._flush_until_below(self.max_pending)
+        elif len(self.pending) >= self.max_batch and self._background is None:
+            self._background = asyncio.ensure_future(self._flush_background())
+
+    async def flush(self):
+        """Write all pending updates. If the write fails, the updates are
+        queued again below any newer ones and the error is raised.
+        Returns
+        -------
+        int
+            Number of documents written.
+        """
+        async with self._lock:
+            batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            encode = self.encode
+            try:
+                requests = [UpdateOne(
+                    self._filter(key),
+                    {'$set': fields if encode is None else encode(fields)},
+                    upsert=True) for key, fields in batch.items()]
+                await self.collection.bulk_write(requests, ordered=False)
+            except BaseException:
+                # Also on cancellation: the write may not have happened and
+                # upserting the same fields again is harmless.
+                self.errors += 1
+                for key, fields in batch.items():
+                    newer = self.pending.get(key)
+                    if newer is not None:
+                        fields.update(newer)
+                    self.pending[key] = fields
+                raise
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    async def close(self):
+        """Wait for a background flush and write everything that is left."""
+        if self._background is not None:
+            await self._background
+        await self.flush()
+
+    def _filter(self, key):
+        if isinstance(self.key_field, str):
+            return {self.key_field: key}
+        return dict(zip(self.key_field, key))
+
+    async def _flush_until_below(self, limit):
+        delay = 0.1
+        while len(self.pending) >= limit:
+            try:
+                await self.flush()
+            except Exception as exc:
+                print(f'Visit flush failed, {len(self.pending)} pending, '
+                      f'retrying in {delay:.1f}s: {exc}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    async def _flush_background(self):
+        try:
+            await self.flush()
+        except Exception as exc:
+            print(f'Visit flush failed, {len(self.pending)} pending: {exc}')
+        finally:
+            self._background = None
@@ -0,0 +1,150 @@
+import heapq
+import sys
+from collections import Counter, defaultdict
+
+
+class VisitStore(object):
+    """
+    Visits by key with time based expiry. Lookup is a dict access;
+    expiry deadlines are kept in a min-heap per register, so `expire` only
+    touches the visits that are due. A visit expires `closed_ttl` seconds
+    after its `last_ts` once its track is closed or it has been matched to
+    a receipt, and `open_ttl` seconds after its `last_ts` otherwise. Visits
+    carry `start_ts` and `last_ts` as integer epoch seconds.
+    The visits themselves may live in a faust Table. The deadlines are
+    derived state that `reindex` rebuilds after the table was recovered.
+    Parameters
+    ----------
+    closed_ttl : int
+        Retention of closed or matched visits in seconds.
+    open_ttl : int
+        Retention of visits that are still open and unmatched.
+    visits : Optional[MutableMapping[str, Visit]]
+        Mapping the visits are kept in, a plain dict by default. Visits are
+        written back to it whenever they change.
+    key : Optional[Callable[[Visit], str]]
+        Key of a visit in the mapping, its `track_id` by default. Track ids
+        are only unique per camera, so visits of several registers need a
+        key that includes the register.
+    """
+
+    def __init__(self, closed_ttl=600, open_ttl=3600, visits=None, key=None):
+        self.closed_ttl = closed_ttl
+        self.open_ttl = open_ttl
+        self.visits = {} if visits is None else visits
+        self.key = (lambda visit: visit.track_id) if key is None else key
+        self.registers = Counter()
+        self.expired = 0
+        self._deadlines = {}  # key -> current expiry deadline
+        self._heaps = defaultdict(list)  # register -> [(deadline, key)]
+
+    def __len__(self):
+        return len(self.visits)
+
+    def __contains__(self, key):
+        return key in self.visits
+
+    def get(self, key, default=None):
+        return self.visits.get(key, default)
+
+    def put(self, visit):
+        """Insert or replace `visit` under its key."""
+        key = self.key(visit)
+        previous = self.visits.get(key)
+        if previous is not None:
+            self.registers[previous.computer.lower()] -= 1
+        self.visits[key] = visit
+        self.registers[visit.computer.lower()] += 1
+        self._schedule(key, visit)
+
+    def touch(self, visit):
+        """Store a visit again after it was extended, closed or matched,
+        and recompute its deadline. A table may return a fresh copy on every
+        read, so the changed visit itself has to be passed.
+        """
+        key = self.key(visit)
+        self.visits[key] = visit
+        self._schedule(key, visit)
+
+    def remove(self, key):
+        """Remove a visit and return it, None if unknown."""
+        visit = self.visits.pop(key, None)
+        if visit is None:
+            return None
+        self.registers[visit.computer.lower()] -= 1
+        # The heap entry goes stale and is skipped by expire.
+        del self._deadlines[key]
+        return visit
+
+    def expire(self, now, register=None):
+        """Remove the visits whose deadline is not after `now`.
+        Parameters
+        ----------
+        now : int
+            Current time in epoch seconds.
+        register : Optional[str]
+            Only expire the visits of this register (lower case), e.g. to
+            delete from a table only while processing an event of the
+            register's partition.
+        Returns
+        -------
+        List[Visit]
+            The expired visits.
+        """
+        if register is None:
+            heaps = list(self._heaps.values())
+        else:
+            heaps = [self._heaps[register]] if register in self._heaps else []
+        deadlines = self._deadlines
+        expired = []
+        for heap in heaps:
+            while heap and heap[0][0] <= now:
+                deadline, key = heapq.heappop(heap)
+                if deadlines.get(key) == deadline:
+                    expired.append(self.remove(key))
+        self.expired += len(expired)
+        return expired
+
+    def reindex(self):
+        """Rebuild the deadlines and counters from the visits mapping."""
+        self.registers.clear()
+        self._deadlines.clear()
+        self._heaps.clear()
+        for key, visit in self.visits.items():
+            self.registers[visit.computer.lower()] += 1
+            self._schedule(key, visit)
+
+    def gauges(self):
+        """Cardinality and approximate memory of the store.
+        Returns
+        -------
+        Dict[str -> object]
+            Number of visits in total and per register, heap entries
+            including stale ones, visits expired so far and the size of the
+            index structures in bytes, not counting the visits themselves.
+        """
+        return {
+            "visits": len(self.visits),
+            "registers": {k: v for k, v in self.registers.items() if v},
+            "heap_entries": sum(len(h) for h in self._heaps.values()),
+            "expired": self.expired,
+            "index_bytes": sum(sys.getsizeof(c) for c in (
+                self._deadlines, *self._heaps.values())),
+        }
+
+    def _schedule(self, key, visit):
+        done = visit.state == 4 or visit.kkm_guid is not None
+        deadline = visit.last_ts + (
+            self.closed_ttl if done else self.open_ttl)
+        if self._deadlines.get(key) == deadline:
+            return
+        self._deadlines[key] = deadline
+        register = visit.computer.lower()
+        heap = self._heaps[register]
+        heapq.heappush(heap, (deadline, key))
+        # Every reschedule leaves a stale entry behind; rebuild the heap
+        # before they outnumber the live ones.
+        if len(heap) > 2 * self.registers[register] + 64:
+            deadlines = self._deadlines
+            heap[:] = [(d, t) for d, t in heap if deadlines.get(t) == d]
+            heapq.heapify(heap)